@@ -56,6 +56,14 @@ else
 fi
 
 cd "${MRB_SOURCE}"
+
+# Checkouts may run concurrently (mrb pullDeps -j): hold a lock on the
+# CMakeLists.txt edits until we exit.
+if type -P flock >/dev/null 2>&1
+then
+  exec 9>>"${MRB_SOURCE}/.add_to_cmake.lock" && flock 9 || exit
+fi
+
 "$libexec/copy_files_to_srcs.sh" "${MRB_SOURCE}" || exit
 
 # have to accumulate the include_directories command in one fragment
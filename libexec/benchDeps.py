@@ -0,0 +1,429 @@
+#!/usr/bin/env python
+# vim: ts=4 expandtab sw=4
+
+"""Benchmark the dependency database tools."""
+
+
+# Builds a synthetic development area in a temporary directory:
+#
+#   products/<base pkg>/v1_00_00/include/<base pkg>/   base products
+#   srcs/<local pkg>/<local pkg>/hdrN.h                 MRB_SOURCE
+#   build/<local pkg>/dirN/CMakeFiles/lib.dir/depend.make
+#                                                       MRB_BUILDDIR
+#   .base_dependency_database                           base database
+#
+# and times makeDep.py and pullDep.py against it.  Nothing outside the
+# temporary directory is used, in particular neither ups nor a real
+# build.  The results are printed as JSON so they can be compared
+# between mrb releases.
+
+import optparse
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+# Force the python version to be at least 2.4.x, which is
+# the version available in SLF5.x distributions (actually
+# they all ship with 2.4.3, and just for reference, all
+# of the SLF6.x distributions ship with 2.6.6).
+if (sys.version_info[0] < 2) or ((sys.version_info[0] == 2) and \
+        (sys.version_info[1] < 4)):
+    print >>sys.stderr, "ERROR: Python version must be at least 2.4!"
+    sys.exit(1)
+
+# The JSON report needs at least python 2.6.
+try:
+    import json
+except ImportError:
+    json = None
+
+# Version of the header of the JSON report.
+report_version = 1
+
+class GLOBALS:
+    """Global variables container."""
+
+    def __init__(self):
+        """Constructor."""
+        # Results of parsing the command line.
+        self.opts = None
+        self.args = None
+        self.libexec = os.path.dirname(os.path.abspath(__file__))
+
+    def parse_options(self):
+        """Parse the command line."""
+        descrip="Generate a synthetic development area and time the " + \
+                "construction and loading of the dependency database, " + \
+                "mrb checkDeps, and the classification of dependency " + \
+                "lines, reporting the results as JSON."
+        p = optparse.OptionParser(description=descrip)
+        p.set_defaults(num_base_pkgs=250, num_local_pkgs=5,
+            num_dep_files=20, num_lines=1000, num_base_edges=200,
+            num_match_lines=100000, num_modified=3, jobs=4, repeat=3,
+            output=None, keep=False)
+        p.add_option("-b", dest="num_base_pkgs", type="int",
+            help="number of base packages [%default]")
+        p.add_option("-l", dest="num_local_pkgs", type="int",
+            help="number of local packages [%default]")
+        p.add_option("-f", dest="num_dep_files", type="int",
+            help="number of depend.make files per local package [%default]")
+        p.add_option("-n", dest="num_lines", type="int",
+            help="number of lines per depend.make file [%default]")
+        p.add_option("-e", dest="num_base_edges", type="int",
+            help="number of base database edges per package [%default]")
+        p.add_option("-m", dest="num_match_lines", type="int",
+            help="number of lines for the matcher benchmark [%default]")
+        p.add_option("-M", dest="num_modified", type="int",
+            help="number of modified headers per local package [%default]")
+        p.add_option("-j", dest="jobs", type="int",
+            help="number of jobs for the parallel scan [%default]")
+        p.add_option("-r", dest="repeat", type="int",
+            help="number of timing repetitions [%default]")
+        p.add_option("-o", dest="output", metavar="FILE",
+            help="write the JSON report to FILE instead of stdout")
+        p.add_option("-k", dest="keep", action="store_true",
+            help="keep the synthetic tree")
+        (self.opts, self.args) = p.parse_args()
+        if json is None:
+            p.error("the JSON report needs the json module (python 2.6)")
+        if self.opts.num_base_pkgs < 1 or self.opts.num_local_pkgs < 1:
+            p.error("need at least one base and one local package")
+
+# Create an object to contain global variables.
+globals = GLOBALS()
+
+class LINEAR_MATCHER:
+    """The original one pattern per base pkg matcher, kept as the
+       reference for the benchmark."""
+
+    def __init__(self, base_pkg_dirs):
+        """Constructor."""
+        self.pat_base_pkgs = {}
+        for pkg in base_pkg_dirs.keys():
+            prod_dir = base_pkg_dirs[pkg]
+            pkg_dir = os.path.join(prod_dir, pkg)
+            self.pat_base_pkgs[pkg] = [
+                re.compile(pkg_dir + os.sep),
+                re.compile(r"([^/]+)/(.*): " + prod_dir + \
+                r"/([^/]+)/v[^/]+/include/(.*[.](?:h|hh|hpp|i|icc|tcc))$") ]
+
+    def collect(self, lines, pkgdepends):
+        """Classify lines, recording them in pkgdepends."""
+        for line in lines:
+            res = None
+            for base_pkg in sorted(self.pat_base_pkgs.keys()):
+                if self.pat_base_pkgs[base_pkg][0].search(line):
+                    res = self.pat_base_pkgs[base_pkg][1].match(line)
+                    break
+            if not res:
+                continue
+            dep = res.group(3)
+            if not pkgdepends.has_key(dep):
+                pkgdepends[dep] = { res.group(4) : 1 }
+            else:
+                pkgdepends[dep][res.group(4)] = 1
+
+class SYSTEM:
+    """Master Controller."""
+
+    def __init__(self):
+        """Constructor."""
+        # Top of the synthetic tree.
+        self.top = None
+        self.products = None
+        self.mrb_source = None
+        self.mrb_build = None
+        # Names of the synthetic base and local pkgs.
+        self.base_pkgs = []
+        self.local_pkgs = []
+        # Environment for running the tools.
+        self.env = None
+        # Results by benchmark name.
+        self.results = {}
+
+    def run(self):
+        """Entry Point."""
+        globals.parse_options()
+        self.top = tempfile.mkdtemp(prefix="mrb_bench_")
+        try:
+            start = time.time()
+            self.make_tree()
+            self.results["generate"] = { "wall" : time.time() - start }
+            self.bench_base_pkg_matching()
+            self.bench_tools()
+        finally:
+            if globals.opts.keep:
+                print >>sys.stderr, "INFO: synthetic tree kept in", self.top
+            else:
+                shutil.rmtree(self.top)
+        self.write_report()
+
+    def header_name(self, pkg, i):
+        """Return the name of header i of pkg, relative to its
+           include directory."""
+        return "%s/hdr%d.h" % (pkg, i)
+
+    def make_tree(self):
+        """Create the synthetic products, source and build areas and
+           the base dependency database."""
+        opts = globals.opts
+        self.products = os.path.join(self.top, "products")
+        self.mrb_source = os.path.join(self.top, "srcs")
+        self.mrb_build = os.path.join(self.top, "build")
+        mrb_install = os.path.join(self.top, "install")
+        os.makedirs(os.path.join(self.mrb_build, "CMakeFiles"))
+        os.makedirs(mrb_install)
+        for i in range(opts.num_base_pkgs):
+            pkg = "base%04d" % i
+            self.base_pkgs.append(pkg)
+            os.makedirs(os.path.join(self.products, pkg, "v1_00_00",
+                "include", pkg))
+        # Local headers are old, except for the modified ones, see
+        # the stat check of pullDep.py.
+        old = time.time() - 86400
+        for i in range(opts.num_local_pkgs):
+            pkg = "local%02d" % i
+            self.local_pkgs.append(pkg)
+            pkg_dir = os.path.join(self.mrb_source, pkg)
+            os.makedirs(os.path.join(pkg_dir, pkg))
+            for j in range(20):
+                hdr = os.path.join(pkg_dir, self.header_name(pkg, j))
+                open(hdr, "w").close()
+                if j >= opts.num_modified:
+                    os.utime(hdr, (old, old))
+            os.utime(os.path.join(pkg_dir, pkg), (old, old))
+            os.utime(pkg_dir, (old, old))
+            self.make_package_build_dir(pkg)
+        self.make_base_database(os.path.join(mrb_install,
+            ".base_dependency_database"))
+        # pullDep.py reads the base database from MRB_TOP.
+        shutil.copy(os.path.join(mrb_install, ".base_dependency_database"),
+            self.top)
+        self.env = os.environ.copy()
+        self.env.update({
+            "MRB_SOURCE" : self.mrb_source,
+            "MRB_BUILDDIR" : self.mrb_build,
+            "MRB_INSTALL" : mrb_install,
+            "MRB_TOP" : self.top,
+            "PRODUCTS" : self.products })
+
+    def make_package_build_dir(self, pkg):
+        """Create the depend.make files of a local pkg."""
+        opts = globals.opts
+        nbase = len(self.base_pkgs)
+        nlocal = len(self.local_pkgs)
+        for i in range(opts.num_dep_files):
+            cmake_dir = os.path.join(self.mrb_build, pkg, "dir%d" % i,
+                "CMakeFiles", "lib.dir")
+            os.makedirs(cmake_dir)
+            outf = open(os.path.join(cmake_dir, "depend.make"), "w")
+            print >>outf, "# CMAKE generated file: DO NOT EDIT!"
+            for j in range(opts.num_lines):
+                print >>outf, "%s: %s" % (
+                    "%s/dir%d/CMakeFiles/lib.dir/src%d.cc.o" % \
+                    (pkg, i, j % 50),
+                    self.dep_path(i * opts.num_lines + j, nbase, nlocal))
+            outf.close()
+
+    def dep_path(self, i, nbase, nlocal):
+        """Return the prerequisite of synthetic dependency line i,
+           mostly base pkg headers with some local headers and
+           source files."""
+        if i % 10 == 0:
+            pkg = self.local_pkgs[(i / 10) % nlocal]
+            return os.path.join(self.mrb_source, pkg,
+                self.header_name(pkg, i % 20))
+        elif i % 10 == 1:
+            return os.path.join(self.mrb_source, "src", "src%d.cc" % \
+                (i % 97))
+        pkg = self.base_pkgs[(i * 7) % nbase]
+        return os.path.join(self.products, pkg, "v1_00_00", "include",
+            self.header_name(pkg, i % 29))
+
+    def make_base_database(self, filename):
+        """Write a synthetic release database, in which every pkg uses
+           headers of the base pkgs before it and of the local pkgs."""
+        opts = globals.opts
+        all_pkgs = self.local_pkgs + self.base_pkgs
+        edges = []
+        for i in range(len(all_pkgs)):
+            pkg = all_pkgs[i]
+            for j in range(opts.num_base_edges):
+                if j % 10 == 0:
+                    dep = self.local_pkgs[j % len(self.local_pkgs)]
+                    dep_file = self.header_name(dep, j % 20)
+                else:
+                    dep = self.base_pkgs[(i + j) % len(self.base_pkgs)]
+                    dep_file = self.header_name(dep, j % 29)
+                edges.append("%s : %s : %s" % (pkg, dep, dep_file))
+        edges.sort()
+        outf = open(filename, "w")
+        last = None
+        for edge in edges:
+            if edge != last:
+                print >>outf, edge
+            last = edge
+        outf.close()
+
+    def bench_base_pkg_matching(self):
+        """Compare the linear and the combined base pkg matchers."""
+        os.environ["MRB_SOURCE"] = self.mrb_source
+        os.environ["PRODUCTS"] = self.products
+        import makeDep
+        md = makeDep.SYSTEM()
+        md.project_pkgs = sorted(self.base_pkgs + self.local_pkgs)
+        for pkg in self.local_pkgs:
+            md.local_pkgs[pkg] = 1
+        md.make_base_pkgs_pats()
+        # Only the lines which do not refer to a local pkg reach the
+        # base pkg matcher.
+        lines = []
+        nbase = len(self.base_pkgs)
+        nlocal = len(self.local_pkgs)
+        for i in range(globals.opts.num_match_lines):
+            line = "pkg/CMakeFiles/lib.dir/src%d.cc.o: %s" % \
+                (i % 97, self.dep_path(i, nbase, nlocal))
+            if not makeDep.globals.pat_mrb_source.search(line):
+                lines.append(line)
+        linear = LINEAR_MATCHER(md.base_pkg_dirs)
+        old_deps = {}
+        old_time = self.best_time(linear.collect, lines, old_deps)
+        new_deps = {}
+        new_time = self.best_time(self.combined_collect, md, lines, new_deps)
+        if old_deps != new_deps:
+            print >>sys.stderr, "ERROR: Matchers disagree!"
+            sys.exit(1)
+        self.results["match"] = {
+            "lines" : len(lines),
+            "linear" : old_time,
+            "combined" : new_time }
+
+    def combined_collect(self, md, lines, pkgdepends):
+        """Classify lines with the makeDep.py base pkg matcher."""
+        for line in lines:
+            res = md.match_base_pkg_line(line)
+            if not res:
+                continue
+            (dep, dep_file) = res
+            if not pkgdepends.has_key(dep):
+                pkgdepends[dep] = { dep_file : 1 }
+            else:
+                pkgdepends[dep][dep_file] = 1
+
+    def best_time(self, func, *args):
+        """Return the best wall time of several calls of func."""
+        best = None
+        for i in range(globals.opts.repeat):
+            start = time.time()
+            func(*args)
+            elapsed = time.time() - start
+            if (best is None) or (elapsed < best):
+                best = elapsed
+        return best
+
+    def bench_tools(self):
+        """Time makeDep.py, loading its database, and pullDep.py."""
+        make_dep = os.path.join(globals.libexec, "makeDep.py")
+        pull_dep = os.path.join(globals.libexec, "pullDep.py")
+        dep_file = os.path.join(self.mrb_build, ".dependency_database")
+        load = "import sys; sys.path.insert(0, %r); import depDatabase; " \
+            "depDatabase.DEPENDENCY_DATABASE().load(%r)" % (globals.libexec, dep_file)
+        self.results["makeDeps_full"] = \
+            self.time_tool([make_dep, "--full"])
+        self.results["makeDeps_cached"] = self.time_tool([make_dep])
+        self.results["makeDeps_parallel"] = \
+            self.time_tool([make_dep, "--full", "-j",
+            str(globals.opts.jobs)])
+        text_bytes = os.stat(dep_file).st_size
+        self.results["load_text"] = self.time_tool(["-c", load])
+        self.results["checkDeps_text"] = self.time_tool([pull_dep, "-n"])
+        self.results["makeDeps_compact"] = \
+            self.time_tool([make_dep, "-f", "compact"])
+        self.results["load_compact"] = self.time_tool(["-c", load])
+        self.results["checkDeps_compact"] = \
+            self.time_tool([pull_dep, "-n"])
+        self.results["database"] = {
+            "base_lines" : self.count_lines(os.path.join(self.top,
+                ".base_dependency_database")),
+            "text_bytes" : text_bytes,
+            "compact_bytes" : os.stat(dep_file).st_size }
+
+    def count_lines(self, filename):
+        """Return the number of lines of a file."""
+        n = 0
+        inf = open(filename, "r")
+        for line in inf:
+            n += 1
+        inf.close()
+        return n
+
+    def time_tool(self, args):
+        """Run python with args in the build area several times,
+           returning the best wall and cpu times and the peak memory."""
+        best = None
+        for i in range(globals.opts.repeat):
+            start = time.time()
+            pid = os.fork()
+            if pid == 0:
+                # Child, keep the output of the tools out of the report.
+                try:
+                    os.chdir(self.mrb_build)
+                    devnull = os.open(os.devnull, os.O_WRONLY)
+                    os.dup2(devnull, 1)
+                    os.dup2(devnull, 2)
+                    os.execve(sys.executable, [sys.executable] + args,
+                        self.env)
+                finally:
+                    os._exit(127)
+            (pid, status, rusage) = os.wait4(pid, 0)
+            elapsed = time.time() - start
+            if (not os.WIFEXITED(status)) or os.WEXITSTATUS(status):
+                print >>sys.stderr, "ERROR: Benchmark command failed:", \
+                    " ".join(args)
+                sys.exit(1)
+            if (best is None) or (elapsed < best["wall"]):
+                best = {
+                    "wall" : elapsed,
+                    "user" : rusage.ru_utime,
+                    "sys" : rusage.ru_stime,
+                    "maxrss_kb" : rusage.ru_maxrss }
+        return best
+
+    def write_report(self):
+        """Write the parameters and results as JSON."""
+        opts = globals.opts
+        report = {
+            "version" : report_version,
+            "mrb_version" : os.environ.get("MRB_VERSION", ""),
+            "python" : sys.version.split()[0],
+            "date" : time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "params" : {
+                "base_pkgs" : opts.num_base_pkgs,
+                "local_pkgs" : opts.num_local_pkgs,
+                "dep_files" : opts.num_dep_files,
+                "lines" : opts.num_lines,
+                "base_edges" : opts.num_base_edges,
+                "match_lines" : opts.num_match_lines,
+                "modified" : opts.num_modified,
+                "jobs" : opts.jobs,
+                "repeat" : opts.repeat },
+            "results" : self.results }
+        if opts.output:
+            outf = open(opts.output, "w")
+        else:
+            outf = sys.stdout
+        json.dump(report, outf, indent=2, sort_keys=True)
+        outf.write("\n")
+        if opts.output:
+            outf.close()
+
+if __name__ == "__main__":
+    # We are being run as a script.
+    system = SYSTEM()
+    system.run()
+else:
+    # We are being loaded as a module.
+    pass
@@ -3,6 +3,18 @@
 # copy base_dependency_database
 # first  look in ${MRB_SOURCE}/${MRB_PROJECT}
 # then look in ${MRB_PROJECTUC}_DIR 
+# in each place base_dependency_database.compact is used in preference
+# to the text base_dependency_database
+#
+# The database is shared between development areas through a cache
+# directory, ${MRB_DEP_CACHE} or else ~/.cache/mrb/dependency_databases,
+# which holds each database in the compact format under
+#   <project>/<version>/<sha1 of the releaseDB file>.compact
+# where <version> is the project version given as the fourth argument.
+# MRB_INSTALL gets a hard link to it, or a symbolic link if the cache
+# is on another file system.  The cached files are read-only, remove
+# the link before putting another base database in its place.  Set
+# MRB_DEP_CACHE=none to copy instead.
 
 # Determine the name of this command
 thisComFull=$(basename $0)
@@ -15,7 +27,7 @@ fullCom="${mrb_command} $thisCom"
 function usage() 
 {
   cat 1>&2 << EOF
-Usage: $fullCom <MRB_INSTALL> <project_directory_name>
+Usage: $fullCom <MRB_SOURCE> <MRB_INSTALL> <project_directory_name> [<project_version>]
   This is a utility function used by mrb.
 EOF
 }
@@ -24,6 +36,7 @@ MRB_SOURCE="${1}"
 MRB_INSTALL="${2}"
 prj_dir=$(printenv | grep ${3} | cut -f2 -d"=")
 if [ -z ${prj_dir} ]; then prj_dir=${3}; fi
+prj_version="${4:-${MRB_PROJECT_VERSION}}"
 
 if [ -z ${MRB_SOURCE} ]
 then
@@ -37,18 +50,76 @@ then
   exit 1
 fi
 
-if [ -e ${MRB_SOURCE}/${MRB_PROJECT}/releaseDB/base_dependency_database ]
+thisDir=$(cd "$(dirname "$0")" && pwd -P)
+dep_cache_dir="${MRB_DEP_CACHE:-${XDG_CACHE_HOME:-${HOME}/.cache}/mrb/dependency_databases}"
+
+# Publish a database in the shared cache, converted to the compact
+# format, and print the path of the cached copy.
+function cache_db()
+{
+  local src="${1}" hash dir cached tmp
+  [ "${dep_cache_dir}" = "none" ] && return 1
+  hash=$(sha1sum < "${src}" 2>/dev/null | cut -d' ' -f1)
+  [ -n "${hash}" ] || return 1
+  dir="${dep_cache_dir}/${MRB_PROJECT:-unknown}/${prj_version:-unknown}"
+  cached="${dir}/${hash}.compact"
+  if [ ! -e "${cached}" ]
+  then
+    mkdir -p "${dir}" 2>/dev/null || return 1
+    tmp="${dir}/.${hash}.$$"
+    if ! "${thisDir}/depDatabase.py" -f compact "${src}" "${tmp}"
+    then
+      rm -f "${tmp}"
+      return 1
+    fi
+    chmod a-w "${tmp}"
+    # Creating the link is atomic, if another area published the
+    # same database first we use theirs.
+    ln "${tmp}" "${cached}" 2>/dev/null
+    rm -f "${tmp}"
+    [ -e "${cached}" ] || return 1
+  fi
+  echo "${cached}"
+}
+
+# Link the database from a releaseDB directory to MRB_INSTALL through
+# the shared cache, or copy it, preferring the compact format (see
+# depDatabase.py) when the release ships one.
+function copy_db()
+{
+  local db_dir="${1}" label="${2}" db cached
+  local dest=${MRB_INSTALL}/.base_dependency_database
+  for db in base_dependency_database.compact base_dependency_database
+  do
+    if [ -e "${db_dir}/releaseDB/${db}" ]
+    then
+      rm -f "${dest}"
+      if cached=$(cache_db "${db_dir}/releaseDB/${db}")
+      then
+        if ln "${cached}" "${dest}" 2>/dev/null || \
+           ln -s "${cached}" "${dest}"
+        then
+          echo "INFO: linking ${label}/releaseDB/${db} from ${cached}"
+          return 0
+        fi
+      fi
+      echo "INFO: copying ${label}/releaseDB/${db}"
+      cp -p "${db_dir}/releaseDB/${db}" "${dest}"
+      return 0
+    fi
+  done
+  return 1
+}
+
+if copy_db ${MRB_SOURCE}/${MRB_PROJECT} "\$MRB_SOURCE/${MRB_PROJECT}"
 then
-    echo "INFO: copying \$MRB_SOURCE/${MRB_PROJECT}/releaseDB/base_dependency_database"
-    cp -p ${MRB_SOURCE}/${MRB_PROJECT}/releaseDB/base_dependency_database ${MRB_INSTALL}/.base_dependency_database
-elif [ -e ${MRB_SOURCE}/${MRB_PROJECT}code/releaseDB/base_dependency_database ]
+    :
+elif copy_db ${MRB_SOURCE}/${MRB_PROJECT}code "\$MRB_SOURCE/${MRB_PROJECT}code"
 then
-    echo "INFO: copying \$MRB_SOURCE/${MRB_PROJECT}code/releaseDB/base_dependency_database"
-    cp -p ${MRB_SOURCE}/${MRB_PROJECT}code/releaseDB/base_dependency_database ${MRB_INSTALL}/.base_dependency_database
-elif [ -e ${prj_dir}/releaseDB/base_dependency_database ]
+    :
+elif copy_db ${prj_dir} ${prj_dir}
 then
-    echo "INFO: copying ${prj_dir}/releaseDB/base_dependency_database"
-    cp -p ${prj_dir}/releaseDB/base_dependency_database ${MRB_INSTALL}/.base_dependency_database
+    :
 else 
     if [ "${3}" != "dummy" ]
     then
@@ -0,0 +1,781 @@
+#!/usr/bin/env python
+# vim: ts=4 expandtab sw=4
+
+"""Read and write dependency databases."""
+
+
+# A dependency database records which header files of which packages
+# each package includes.  It is kept on disk in one of two forms:
+#
+# text:    one "pkg : dep : dep_file" line per edge, sorted.
+#
+# compact: a binary file which can be memory-mapped and queried without
+#          loading it.  All numbers are little-endian unsigned 32-bit.
+#
+#          header:  magic "MRBDEPDB", version, number of pkgs,
+#                   number of files, number of edges, then the offsets
+#                   of the eight sections below.
+#          pkg names:    string table, sorted, the index of a name is
+#                        the id of the pkg.
+#          file names:   string table, sorted, ids as for pkgs.
+#          fwd index:    npkgs + 1 entries, the edges of pkg p are
+#                        fwd edges [fwd index[p], fwd index[p + 1]).
+#          fwd edges:    (dep id, file id) pairs, sorted by
+#                        (pkg, dep, file).
+#          rev index:    npkgs + 1 entries, the consumers of dep d are
+#                        rev edges [rev index[d], rev index[d + 1]).
+#          rev edges:    (pkg id, file id) pairs, sorted by
+#                        (dep, pkg, file).
+#
+#          A string table is nstrings + 1 offsets into the string
+#          data which follows them.
+#
+# Both forms load into a DEPENDENCY_DATABASE, the format of a file is
+# recognized by its first bytes.
+
+import array
+import heapq
+import mmap
+import optparse
+import os
+import struct
+import sys
+
+# Force the python version to be at least 2.4.x, which is
+# the version available in SLF5.x distributions (actually
+# they all ship with 2.4.3, and just for reference, all
+# of the SLF6.x distributions ship with 2.6.6).
+if (sys.version_info[0] < 2) or ((sys.version_info[0] == 2) and \
+        (sys.version_info[1] < 4)):
+    print >>sys.stderr, "ERROR: Python version must be at least 2.4!"
+    sys.exit(1)
+
+compact_magic = "MRBDEPDB"
+compact_version = 1
+compact_header = "<8s12I"
+compact_header_size = struct.calcsize(compact_header)
+
+# Array type code of an unsigned 32-bit integer.
+if array.array("I").itemsize == 4:
+    uint32_code = "I"
+else:
+    uint32_code = "L"
+
+def is_compact_database(filename):
+    """Check if filename is a compact format database."""
+    inf = open(filename, "rb")
+    magic = inf.read(len(compact_magic))
+    inf.close()
+    return magic == compact_magic
+
+class UNSORTED_DATABASE(ValueError):
+    """A database which should be sorted is not."""
+    pass
+
+def sorted_edges(edges, filename):
+    """Generate the edges of a stream read from filename, checking
+       that they are sorted and dropping duplicates.  Raises
+       UNSORTED_DATABASE at the first edge out of order."""
+    last = None
+    n = 0
+    for edge in edges:
+        n += 1
+        if last is not None:
+            if edge == last:
+                continue
+            if edge < last:
+                raise UNSORTED_DATABASE("%s is not sorted at edge %d" % \
+                    (filename, n))
+        last = edge
+        yield edge
+
+def iter_text_edges(filename):
+    """Generate the (pkg, dep, dep_file) edges of a text format
+       database in file order."""
+    inf = open(filename, "r")
+    for line in inf:
+        (pkg, dep, dep_file) = line.split(":")
+        yield (pkg.strip(), dep.strip(), dep_file.strip())
+    inf.close()
+
+def iter_database_edges(filename):
+    """Generate the edges of a database of either format in sorted
+       order without loading it.  A text database which is not sorted,
+       made by hand or by an old tool, raises UNSORTED_DATABASE."""
+    if is_compact_database(filename):
+        db = COMPACT_DATABASE(filename)
+        for edge in db.edges():
+            yield edge
+        db.close()
+    else:
+        for edge in sorted_edges(iter_text_edges(filename), filename):
+            yield edge
+
+def database_packages(filename):
+    """Return the sorted names of the pkgs which have edges in a
+       database of either format."""
+    if is_compact_database(filename):
+        db = COMPACT_DATABASE(filename)
+        pkgs = db.packages_with_deps()
+        db.close()
+        return pkgs
+    pkgs = {}
+    last_pkg = None
+    inf = open(filename, "r")
+    for line in inf:
+        pkg = line.split(":", 1)[0]
+        if pkg != last_pkg:
+            last_pkg = pkg
+            pkgs[pkg.strip()] = 1
+    inf.close()
+    return sorted(pkgs.keys())
+
+def merge_edges(streams):
+    """Merge sorted edge streams into one sorted stream, dropping
+       duplicate edges.  Only the current edge of each stream is held
+       in memory."""
+    heap = []
+    for i in range(len(streams)):
+        it = iter(streams[i])
+        for edge in it:
+            heap.append((edge, i, it))
+            break
+    heapq.heapify(heap)
+    last = None
+    while len(heap) > 1:
+        (edge, i, it) = heap[0]
+        try:
+            heapq.heapreplace(heap, (it.next(), i, it))
+        except StopIteration:
+            heapq.heappop(heap)
+        if edge != last:
+            last = edge
+            yield edge
+    # Once a single stream is left, it needs no more merging.
+    for (edge, i, it) in heap:
+        if edge != last:
+            last = edge
+            yield edge
+        for edge in it:
+            if edge != last:
+                last = edge
+                yield edge
+
+def diff_edges(old_edges, new_edges):
+    """Generate (sign, edge) for each edge of two sorted edge streams,
+       sign is -1 for an edge only in old, 1 for an edge only in new
+       and 0 for an edge in both.  Only the current edge of each stream
+       is held in memory."""
+    old_it = iter(old_edges)
+    new_it = iter(new_edges)
+    old = None
+    new = None
+    for old in old_it:
+        break
+    for new in new_it:
+        break
+    while (old is not None) and (new is not None):
+        if old < new:
+            yield (-1, old)
+            advance_old = True
+            advance_new = False
+        elif new < old:
+            yield (1, new)
+            advance_old = False
+            advance_new = True
+        else:
+            yield (0, old)
+            advance_old = True
+            advance_new = True
+        if advance_old:
+            try:
+                old = old_it.next()
+            except StopIteration:
+                old = None
+        if advance_new:
+            try:
+                new = new_it.next()
+            except StopIteration:
+                new = None
+    if old is not None:
+        yield (-1, old)
+        for old in old_it:
+            yield (-1, old)
+    if new is not None:
+        yield (1, new)
+        for new in new_it:
+            yield (1, new)
+
+def write_text_database(edges, filename):
+    """Write the sorted (pkg, dep, dep_file) edges to filename in
+       text format.  The file is written through a large buffer under
+       a temporary name and renamed into place."""
+    tmp_name = "%s.%d" % (filename, os.getpid())
+    outf = open(tmp_name, "w", 1 << 16)
+    try:
+        outf.writelines("%s : %s : %s\n" % edge for edge in edges)
+    except:
+        outf.close()
+        os.unlink(tmp_name)
+        raise
+    outf.close()
+    os.rename(tmp_name, filename)
+
+def pack_uint32s(values):
+    """Return values as little-endian unsigned 32-bit integers."""
+    arr = array.array(uint32_code, values)
+    if sys.byteorder == "big":
+        arr.byteswap()
+    return arr.tostring()
+
+def pack_string_table(names):
+    """Return a string table for names."""
+    offsets = [0]
+    for name in names:
+        offsets.append(offsets[-1] + len(name))
+    return pack_uint32s(offsets) + "".join(names)
+
+def write_compact_database(edges, filename):
+    """Write the sorted (pkg, dep, dep_file) edges to filename in
+       compact format.  The file is written under a temporary name
+       and renamed into place.  Raises UNSORTED_DATABASE if the edges
+       are not sorted, the indexes would be wrong."""
+    pkg_ids = {}
+    file_ids = {}
+    fwd_pkgs = array.array(uint32_code)
+    fwd_deps = array.array(uint32_code)
+    fwd_files = array.array(uint32_code)
+    last = None
+    for edge in edges:
+        if (last is not None) and (edge < last):
+            raise UNSORTED_DATABASE("edges for %s are not sorted" % \
+                filename)
+        last = edge
+        (pkg, dep, dep_file) = edge
+        for name in (pkg, dep):
+            if not pkg_ids.has_key(name):
+                pkg_ids[name] = len(pkg_ids)
+        if not file_ids.has_key(dep_file):
+            file_ids[dep_file] = len(file_ids)
+        fwd_pkgs.append(pkg_ids[pkg])
+        fwd_deps.append(pkg_ids[dep])
+        fwd_files.append(file_ids[dep_file])
+    # Renumber the ids in name order, the edges are sorted by name
+    # so they stay sorted by id.
+    pkgs = sorted(pkg_ids.keys())
+    files = sorted(file_ids.keys())
+    pkg_map = array.array(uint32_code, [0] * len(pkgs))
+    for i in range(len(pkgs)):
+        pkg_map[pkg_ids[pkgs[i]]] = i
+    file_map = array.array(uint32_code, [0] * len(files))
+    for i in range(len(files)):
+        file_map[file_ids[files[i]]] = i
+    del pkg_ids, file_ids
+    nedges = len(fwd_pkgs)
+    fwd_index = [0] * (len(pkgs) + 1)
+    rev_index = [0] * (len(pkgs) + 1)
+    fwd_edges = array.array(uint32_code, [0] * (2 * nedges))
+    for j in range(nedges):
+        pkg_id = fwd_pkgs[j] = pkg_map[fwd_pkgs[j]]
+        dep_id = fwd_deps[j] = pkg_map[fwd_deps[j]]
+        file_id = fwd_files[j] = file_map[fwd_files[j]]
+        fwd_index[pkg_id + 1] += 1
+        rev_index[dep_id + 1] += 1
+        fwd_edges[2 * j] = dep_id
+        fwd_edges[2 * j + 1] = file_id
+    for i in range(len(pkgs)):
+        fwd_index[i + 1] += fwd_index[i]
+        rev_index[i + 1] += rev_index[i]
+    # A stable counting sort by dep of the edges sorted by
+    # (pkg, dep, file) leaves them sorted by (dep, pkg, file).
+    rev_edges = array.array(uint32_code, [0] * (2 * nedges))
+    next_pos = rev_index[:]
+    for j in range(nedges):
+        pos = next_pos[fwd_deps[j]]
+        next_pos[fwd_deps[j]] = pos + 1
+        rev_edges[2 * pos] = fwd_pkgs[j]
+        rev_edges[2 * pos + 1] = fwd_files[j]
+    del fwd_pkgs, fwd_deps, fwd_files, next_pos
+    # Lay the sections out after the header, 4-byte aligned.
+    sections = [
+        pack_string_table(pkgs),
+        pack_string_table(files),
+        pack_uint32s(fwd_index),
+        pack_uint32s(fwd_edges),
+        pack_uint32s(rev_index),
+        pack_uint32s(rev_edges) ]
+    offsets = []
+    pos = compact_header_size
+    for i in range(len(sections)):
+        if len(sections[i]) % 4:
+            sections[i] += "\0" * (4 - len(sections[i]) % 4)
+        offsets.append(pos)
+        pos += len(sections[i])
+    # The string tables are two sections each in the header.
+    pkg_off = offsets[0]
+    file_off = offsets[1]
+    header = struct.pack(compact_header, compact_magic, compact_version,
+        len(pkgs), len(files), nedges,
+        pkg_off, pkg_off + 4 * (len(pkgs) + 1),
+        file_off, file_off + 4 * (len(files) + 1),
+        offsets[2], offsets[3], offsets[4], offsets[5])
+    tmp_name = "%s.%d" % (filename, os.getpid())
+    outf = open(tmp_name, "wb")
+    outf.write(header)
+    for section in sections:
+        outf.write(section)
+    outf.close()
+    os.rename(tmp_name, filename)
+
+class DEPENDENCY_DATABASE:
+    """In-memory dependency database.
+
+    Pkg and file names are interned, each edge is stored as the file
+    id in an array of unsigned integers kept per (pkg, dep) pair:
+
+        pkg_deps:   { pkg id : { dep id : array of file ids } }
+
+    The reverse index is built from pkg_deps when it is first needed
+    and shares its arrays.  A pkg may have an entry without any
+    edges, which is enough for it to replace the same pkg in merge().
+    """
+
+    def __init__(self):
+        """Constructor."""
+        self.pkg_names = []
+        self.pkg_ids = {}
+        self.file_names = []
+        self.file_ids = {}
+        self.pkg_deps = {}
+        # { dep id : { pkg id : array of file ids } }
+        self.rdeps = None
+
+    def intern_pkg(self, pkg):
+        """Return the id of pkg, adding it if it is new."""
+        i = self.pkg_ids.get(pkg)
+        if i is None:
+            i = len(self.pkg_names)
+            self.pkg_names.append(pkg)
+            self.pkg_ids[pkg] = i
+        return i
+
+    def intern_file(self, dep_file):
+        """Return the id of dep_file, adding it if it is new."""
+        i = self.file_ids.get(dep_file)
+        if i is None:
+            i = len(self.file_names)
+            self.file_names.append(dep_file)
+            self.file_ids[dep_file] = i
+        return i
+
+    def add_pkg(self, pkg):
+        """Give pkg an entry, returning its { dep id : files } dictionary."""
+        pkg_id = self.intern_pkg(pkg)
+        pdeps = self.pkg_deps.get(pkg_id)
+        if pdeps is None:
+            pdeps = self.pkg_deps[pkg_id] = {}
+        return pdeps
+
+    def add_edge(self, pkg, dep, dep_file):
+        """Record an edge."""
+        pdeps = self.add_pkg(pkg)
+        dep_id = self.intern_pkg(dep)
+        files = pdeps.get(dep_id)
+        if files is None:
+            files = pdeps[dep_id] = array.array(uint32_code)
+        files.append(self.intern_file(dep_file))
+        self.rdeps = None
+
+    def replace_pkg(self, pkg, deps):
+        """Replace the edges of pkg with deps, a { dep : { dep_file : 1 } }
+           dictionary."""
+        pdeps = self.pkg_deps[self.intern_pkg(pkg)] = {}
+        for dep in deps.keys():
+            pdeps[self.intern_pkg(dep)] = array.array(uint32_code,
+                [self.intern_file(dep_file) for dep_file in deps[dep].keys()])
+        self.rdeps = None
+
+    def merge(self, other):
+        """Replace the pkgs of this database with those of other."""
+        for (pkg_id, other_deps) in other.pkg_deps.items():
+            pkg = other.pkg_names[pkg_id]
+            pdeps = self.pkg_deps[self.intern_pkg(pkg)] = {}
+            for (dep_id, files) in other_deps.items():
+                pdeps[self.intern_pkg(other.pkg_names[dep_id])] = \
+                    array.array(uint32_code, [self.intern_file(
+                        other.file_names[f]) for f in files])
+        self.rdeps = None
+
+    def load(self, filename, wanted=None):
+        """Load a database of either format.  If wanted is given, only
+           the edges into the deps in wanted are loaded, every pkg of
+           the file still gets an entry."""
+        if is_compact_database(filename):
+            self.load_compact(filename, wanted)
+        else:
+            self.load_text(filename, wanted)
+
+    def load_text(self, filename, wanted=None):
+        """Load a text format database."""
+        last_pkg = None
+        last_dep = None
+        pdeps = None
+        files = None
+        file_ids = self.file_ids
+        inf = open(filename, "r")
+        for line in inf:
+            #print >>sys.stderr, "DEBUG:", line,
+            (pkg, dep, dep_file) = line.split(":")
+            # The lines are sorted, so most repeat the pkg and dep
+            # of the line before.
+            pkg = pkg.strip()
+            if pkg != last_pkg:
+                last_pkg = pkg
+                last_dep = None
+                pdeps = self.add_pkg(pkg)
+            dep = dep.strip()
+            if dep != last_dep:
+                last_dep = dep
+                if (wanted is not None) and (not wanted.has_key(dep)):
+                    files = None
+                    continue
+                dep_id = self.intern_pkg(dep)
+                files = pdeps.get(dep_id)
+                if files is None:
+                    files = pdeps[dep_id] = array.array(uint32_code)
+            if files is None:
+                continue
+            dep_file = dep_file.strip()
+            file_id = file_ids.get(dep_file)
+            if file_id is None:
+                file_id = self.intern_file(dep_file)
+            files.append(file_id)
+        inf.close()
+        self.rdeps = None
+
+    def load_compact(self, filename, wanted=None):
+        """Load a compact format database.  If wanted is given, the
+           edges into its deps are looked up in place."""
+        db = COMPACT_DATABASE(filename)
+        if wanted is None:
+            pkg_map = [self.intern_pkg(pkg) for pkg in db.packages()]
+            file_map = [self.intern_file(dep_file) for dep_file in
+                db.strings(db.file_off, db.file_data, db.nfiles)]
+            index = db.uint32s(db.fwd_index, db.npkgs + 1)
+            edges = db.uint32s(db.fwd_edges, 2 * db.nedges)
+            for i in range(db.npkgs):
+                if index[i + 1] == index[i]:
+                    continue
+                pdeps = self.pkg_deps[pkg_map[i]] = {}
+                for j in range(index[i], index[i + 1]):
+                    dep_id = pkg_map[edges[2 * j]]
+                    files = pdeps.get(dep_id)
+                    if files is None:
+                        files = pdeps[dep_id] = array.array(uint32_code)
+                    files.append(file_map[edges[2 * j + 1]])
+        else:
+            for pkg in db.packages_with_deps():
+                self.add_pkg(pkg)
+            for dep in wanted.keys():
+                consumers = db.consumers_of(dep)
+                for pkg in consumers.keys():
+                    for dep_file in consumers[pkg]:
+                        self.add_edge(pkg, dep, dep_file)
+        db.close()
+        self.rdeps = None
+
+    def names_of_files(self, files):
+        """Return the sorted, unique names of an array of file ids."""
+        names = dict.fromkeys([self.file_names[f] for f in files], 1).keys()
+        names.sort()
+        return names
+
+    def has_pkg(self, pkg):
+        """Check if pkg has an entry."""
+        return self.pkg_deps.has_key(self.pkg_ids.get(pkg))
+
+    def packages(self):
+        """Return the sorted names of the pkgs which have an entry."""
+        return sorted([self.pkg_names[i] for i in self.pkg_deps.keys()])
+
+    def deps_of(self, pkg):
+        """Return the sorted names of the deps of pkg."""
+        pdeps = self.pkg_deps.get(self.pkg_ids.get(pkg), {})
+        return sorted([self.pkg_names[i] for i in pdeps.keys()])
+
+    def headers_used(self, pkg, dep):
+        """Return the sorted names of the files of dep which pkg uses."""
+        pdeps = self.pkg_deps.get(self.pkg_ids.get(pkg), {})
+        return self.names_of_files(pdeps.get(self.pkg_ids.get(dep), []))
+
+    def reverse_index(self):
+        """Return the { dep id : { pkg id : array of file ids } } index."""
+        if self.rdeps is None:
+            self.rdeps = {}
+            for (pkg_id, pdeps) in self.pkg_deps.items():
+                for (dep_id, files) in pdeps.items():
+                    if not self.rdeps.has_key(dep_id):
+                        self.rdeps[dep_id] = { pkg_id : files }
+                    else:
+                        self.rdeps[dep_id][pkg_id] = files
+        return self.rdeps
+
+    def consumer_pkgs(self, dep):
+        """Return the sorted names of the pkgs which use dep."""
+        consumers = self.reverse_index().get(self.pkg_ids.get(dep), {})
+        return sorted([self.pkg_names[i] for i in consumers.keys()])
+
+    def consumers_of(self, dep, files=None):
+        """Return { pkg : [dep_file, ...] } for the pkgs which use dep.
+           If files is given, only the pkgs which use one of those files
+           of dep are returned, with only those files."""
+        result = {}
+        consumers = self.reverse_index().get(self.pkg_ids.get(dep), {})
+        if files is not None:
+            wanted = {}
+            for dep_file in files:
+                if self.file_ids.has_key(dep_file):
+                    wanted[self.file_ids[dep_file]] = 1
+        for (pkg_id, pkg_files) in consumers.items():
+            if files is not None:
+                pkg_files = [f for f in pkg_files if wanted.has_key(f)]
+                if not pkg_files:
+                    continue
+            result[self.pkg_names[pkg_id]] = self.names_of_files(pkg_files)
+        return result
+
+    def edges(self):
+        """Generate all (pkg, dep, dep_file) edges in sorted order."""
+        for pkg in self.packages():
+            pdeps = self.pkg_deps[self.pkg_ids[pkg]]
+            deps = [(self.pkg_names[i], i) for i in pdeps.keys()]
+            deps.sort()
+            for (dep, dep_id) in deps:
+                for dep_file in self.names_of_files(pdeps[dep_id]):
+                    yield (pkg, dep, dep_file)
+
+    def write_text(self, filename):
+        """Write the database to filename in text format."""
+        write_text_database(self.edges(), filename)
+
+    def write_compact(self, filename):
+        """Write the database to filename in compact format."""
+        write_compact_database(self.edges(), filename)
+
+class COMPACT_DATABASE:
+    """Memory-mapped compact format database."""
+
+    def __init__(self, filename):
+        """Constructor."""
+        self.filename = filename
+        inf = open(filename, "rb")
+        self.mm = mmap.mmap(inf.fileno(), 0, access=mmap.ACCESS_READ)
+        inf.close()
+        fields = struct.unpack(compact_header,
+            self.mm[:compact_header_size])
+        if fields[0] != compact_magic:
+            raise ValueError("%s is not a compact dependency database" % \
+                filename)
+        if fields[1] != compact_version:
+            raise ValueError("%s has unsupported version %d" % \
+                (filename, fields[1]))
+        (self.npkgs, self.nfiles, self.nedges,
+            self.pkg_off, self.pkg_data, self.file_off, self.file_data,
+            self.fwd_index, self.fwd_edges,
+            self.rev_index, self.rev_edges) = fields[2:]
+
+    def close(self):
+        """Unmap the database."""
+        self.mm.close()
+
+    def uint32s(self, off, n):
+        """Return the n unsigned 32-bit integers at off."""
+        arr = array.array(uint32_code)
+        arr.fromstring(self.mm[off:off + 4 * n])
+        if sys.byteorder == "big":
+            arr.byteswap()
+        return arr
+
+    def string(self, off, data, i):
+        """Return string i of a string table."""
+        (start, end) = self.uint32s(off + 4 * i, 2)
+        return self.mm[data + start:data + end]
+
+    def strings(self, off, data, n):
+        """Return all strings of a string table."""
+        offsets = self.uint32s(off, n + 1)
+        blob = self.mm[data:data + offsets[n]]
+        return [blob[offsets[i]:offsets[i + 1]] for i in range(n)]
+
+    def find(self, off, data, n, name):
+        """Return the index of name in a string table, or None."""
+        lo = 0
+        hi = n
+        while lo < hi:
+            mid = (lo + hi) / 2
+            val = self.string(off, data, mid)
+            if val < name:
+                lo = mid + 1
+            elif val > name:
+                hi = mid
+            else:
+                return mid
+        return None
+
+    def pkg_name(self, i):
+        """Return the name of pkg id i."""
+        return self.string(self.pkg_off, self.pkg_data, i)
+
+    def file_name(self, i):
+        """Return the name of file id i."""
+        return self.string(self.file_off, self.file_data, i)
+
+    def pkg_id(self, pkg):
+        """Return the id of pkg, or None if it is unknown."""
+        return self.find(self.pkg_off, self.pkg_data, self.npkgs, pkg)
+
+    def packages(self):
+        """Return the names of all pkgs."""
+        return self.strings(self.pkg_off, self.pkg_data, self.npkgs)
+
+    def packages_with_deps(self):
+        """Return the names of the pkgs which have edges."""
+        pkgs = self.packages()
+        index = self.uint32s(self.fwd_index, self.npkgs + 1)
+        return [pkgs[i] for i in range(self.npkgs) if index[i + 1] > index[i]]
+
+    def edge_range(self, index, i):
+        """Return the (first, count) of the edges of pkg id i."""
+        (start, end) = self.uint32s(index + 4 * i, 2)
+        return (start, end - start)
+
+    def deps_of(self, pkg):
+        """Return { dep : [dep_file, ...] } for the edges of pkg."""
+        result = {}
+        i = self.pkg_id(pkg)
+        if i is None:
+            return result
+        (start, count) = self.edge_range(self.fwd_index, i)
+        edges = self.uint32s(self.fwd_edges + 8 * start, 2 * count)
+        for j in range(0, len(edges), 2):
+            dep = self.pkg_name(edges[j])
+            if not result.has_key(dep):
+                result[dep] = []
+            result[dep].append(self.file_name(edges[j + 1]))
+        return result
+
+    def consumers_of(self, dep):
+        """Return { pkg : [dep_file, ...] } for the pkgs using dep."""
+        result = {}
+        i = self.pkg_id(dep)
+        if i is None:
+            return result
+        (start, count) = self.edge_range(self.rev_index, i)
+        edges = self.uint32s(self.rev_edges + 8 * start, 2 * count)
+        for j in range(0, len(edges), 2):
+            pkg = self.pkg_name(edges[j])
+            if not result.has_key(pkg):
+                result[pkg] = []
+            result[pkg].append(self.file_name(edges[j + 1]))
+        return result
+
+    def edges(self):
+        """Generate all (pkg, dep, dep_file) edges in sorted order."""
+        pkgs = self.packages()
+        files = self.strings(self.file_off, self.file_data, self.nfiles)
+        index = self.uint32s(self.fwd_index, self.npkgs + 1)
+        edges = self.uint32s(self.fwd_edges, 2 * self.nedges)
+        for i in range(self.npkgs):
+            pkg = pkgs[i]
+            for j in range(index[i], index[i + 1]):
+                yield (pkg, pkgs[edges[2 * j]], files[edges[2 * j + 1]])
+
+class GLOBALS:
+    """Global variables container."""
+
+    def __init__(self):
+        """Constructor."""
+        # Results of parsing the command line.
+        self.opts = None
+        self.args = None
+
+    def parse_options(self):
+        """Parse the command line."""
+        descrip="Convert a dependency database between the text and " + \
+                "the compact format, or query a database.  The format " + \
+                "of the input is recognized automatically."
+        usage="%prog [options] <input> [<output>]"
+        p = optparse.OptionParser(usage=usage, description=descrip)
+        p.set_defaults(format="compact", deps_of=None, consumers_of=None)
+        p.add_option("-f", dest="format", type="choice",
+            choices=["text", "compact"],
+            help="format of the output, text or compact [%default]")
+        p.add_option("-d", dest="deps_of", metavar="PKG",
+            help="print the edges of PKG instead of converting")
+        p.add_option("-c", dest="consumers_of", metavar="PKG",
+            help="print the edges into PKG instead of converting")
+        (self.opts, self.args) = p.parse_args()
+        querying = self.opts.deps_of or self.opts.consumers_of
+        if (not self.args) or (len(self.args) > 2) or \
+                (querying and (len(self.args) != 1)) or \
+                ((not querying) and (len(self.args) != 2)):
+            p.error("wrong number of arguments")
+
+# Create an object to contain global variables.
+globals = GLOBALS()
+
+class SYSTEM:
+    """Master Controller."""
+
+    def run(self):
+        """Entry Point."""
+        globals.parse_options()
+        infile = globals.args[0]
+        if globals.opts.deps_of or globals.opts.consumers_of:
+            self.query(infile)
+            return
+        db = DEPENDENCY_DATABASE()
+        db.load(infile)
+        if globals.opts.format == "compact":
+            db.write_compact(globals.args[1])
+        else:
+            db.write_text(globals.args[1])
+
+    def query(self, infile):
+        """Print the edges of, or into, a pkg."""
+        if is_compact_database(infile):
+            db = COMPACT_DATABASE(infile)
+            deps_of = db.deps_of
+            consumers_of = db.consumers_of
+        else:
+            db = None
+            text_db = DEPENDENCY_DATABASE()
+            text_db.load_text(infile)
+            def deps_of(pkg):
+                result = {}
+                for dep in text_db.deps_of(pkg):
+                    result[dep] = text_db.headers_used(pkg, dep)
+                return result
+            consumers_of = text_db.consumers_of
+        if globals.opts.deps_of:
+            pkg = globals.opts.deps_of
+            pkg_deps = deps_of(pkg)
+            for dep in sorted(pkg_deps.keys()):
+                for dep_file in sorted(pkg_deps[dep]):
+                    print "%s : %s : %s" % (pkg, dep, dep_file)
+        if globals.opts.consumers_of:
+            dep = globals.opts.consumers_of
+            consumers = consumers_of(dep)
+            for pkg in sorted(consumers.keys()):
+                for dep_file in sorted(consumers[pkg]):
+                    print "%s : %s : %s" % (pkg, dep, dep_file)
+        if db is not None:
+            db.close()
+
+if __name__ == "__main__":
+    # We are being run as a script.
+    system = SYSTEM()
+    system.run()
+else:
+    # We are being loaded as a module.
+    pass
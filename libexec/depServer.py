@@ -0,0 +1,353 @@
+#!/usr/bin/env python
+# vim: ts=4 expandtab sw=4
+
+"""Keep dependency databases loaded for checkDeps and pullDeps."""
+
+
+# mrb depServer starts a server in the background which keeps the
+# databases read by pullDep.py loaded and indexed, and answers its
+# queries over the Unix domain socket $MRB_TOP/.mrb_dep_server.  Before
+# each query the files are checked with stat and reloaded if they have
+# changed, by mrb makeDeps for instance, so answers are never stale.
+# When no server is running pullDep.py loads the databases itself.
+#
+# A request is one line of tab separated fields, the answer is a line
+# "OK" or "ERROR: <message>" followed by the lines of the result:
+#
+#   consumers <base> <local> <dep> [<dep> ...]
+#       the "pkg : dep : dep_file" edges into the deps of the local
+#       database over the base database, a pkg of the local database
+#       replaces that pkg in the base database as in pullDep.py.
+#   used_by <objects> [<pkg> <dep_file> ...]
+#       the targets of the object database written by makeDeps
+#       --objects which use the given headers.
+#   status
+#       what the server has loaded.
+#   stop
+#       stop the server.
+#
+# Only the databases of this development area are loaded, the base
+# database in MRB_TOP and the local and object databases in
+# MRB_BUILDDIR or another build directory in MRB_TOP.
+
+import depDatabase
+import optparse
+import os
+import select
+import signal
+import socket
+import sys
+import time
+
+# Force the python version to be at least 2.4.x, which is
+# the version available in SLF5.x distributions (actually
+# they all ship with 2.4.3, and just for reference, all
+# of the SLF6.x distributions ship with 2.6.6).
+if (sys.version_info[0] < 2) or ((sys.version_info[0] == 2) and \
+        (sys.version_info[1] < 4)):
+    print >>sys.stderr, "ERROR: Python version must be at least 2.4!"
+    sys.exit(1)
+
+def socket_name(mrb_top):
+    """Return the name of the socket of the server of mrb_top."""
+    return os.path.join(mrb_top, ".mrb_dep_server")
+
+def query(name, fields, timeout=60.0):
+    """Send a request to the server listening on socket name and
+       return the lines of its answer, or None if no server is running
+       or it could not answer."""
+    if not os.path.exists(name):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            sock.settimeout(timeout)
+            sock.connect(name)
+            sock.sendall("\t".join(fields) + "\n")
+            inf = sock.makefile("rb", 65536)
+            status = inf.readline()
+            lines = inf.readlines()
+            inf.close()
+        except socket.error:
+            return None
+    finally:
+        sock.close()
+    if status != "OK\n":
+        if status:
+            print >>sys.stderr, "WARNING: mrb depServer:", status.strip()
+        return None
+    return lines
+
+# The names of the databases which can be loaded.
+base_database_name = ".base_dependency_database"
+local_database_name = ".dependency_database"
+objects_database_name = ".dependency_database.objects"
+
+def file_stamp(filename):
+    """Return what identifies the contents of filename, or None if
+       there is no such file."""
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime)
+
+def raise_exit(signum, frame):
+    """Signal handler to clean up on SIGTERM."""
+    sys.exit(0)
+
+class GLOBALS:
+    """Global variables container."""
+
+    def __init__(self):
+        """Constructor."""
+        # Results of parsing the command line.
+        self.opts = None
+        self.args = None
+        self.mrb_top = os.environ.get("MRB_TOP", "")
+        self.mrb_build = os.environ.get("MRB_BUILDDIR", "")
+        self.socket_name = socket_name(self.mrb_top)
+        self.log_file_name = self.socket_name + ".log"
+
+    def parse_options(self):
+        """Parse the command line."""
+        descrip="Keep the dependency databases used by checkDeps " + \
+                "and pullDeps loaded in a server process for this " + \
+                "development area, so that they answer without " + \
+                "reading them.  The server reloads a database when " + \
+                "it changes, and exits when it has been idle for a " + \
+                "while."
+        usage="%prog [options]"
+        p = optparse.OptionParser(usage=usage, description=descrip)
+        p.set_defaults(action="start", foreground=False, idle=3600.0)
+        p.add_option("--stop", dest="action", action="store_const",
+            const="stop", help="stop the running server")
+        p.add_option("--status", dest="action", action="store_const",
+            const="status", help="report on the running server")
+        p.add_option("--foreground", dest="foreground",
+            action="store_true",
+            help="serve in the foreground, logging to stderr")
+        p.add_option("--idle", dest="idle", type="float",
+            metavar="SECONDS", help="exit after SECONDS without a " + \
+            "query, 0 means never [%default]")
+        (self.opts, self.args) = p.parse_args()
+        if self.args:
+            p.error("wrong number of arguments")
+        if not self.mrb_top:
+            p.error("MRB_TOP is not defined")
+
+# Create an object to contain global variables.
+globals = GLOBALS()
+
+class SYSTEM:
+    """Master Controller."""
+
+    def __init__(self):
+        """Constructor."""
+        # Loaded databases, { filename : (stamp, database) }.
+        self.databases = {}
+        self.started = time.time()
+        self.queries = 0
+        self.stopping = False
+
+    def run(self):
+        """Entry Point."""
+        globals.parse_options()
+        if globals.opts.action != "start":
+            lines = query(globals.socket_name, [globals.opts.action])
+            if lines is None:
+                print >>sys.stderr, "INFO: no mrb depServer is running " + \
+                    "for", globals.mrb_top
+                sys.exit(1)
+            sys.stdout.writelines(lines)
+            return
+        if query(globals.socket_name, ["status"]) is not None:
+            print >>sys.stderr, "INFO: mrb depServer is already running " + \
+                "for", globals.mrb_top
+            return
+        if os.path.exists(globals.socket_name):
+            # Left behind by a server which did not exit cleanly.
+            os.unlink(globals.socket_name)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(077)
+        try:
+            listener.bind(globals.socket_name)
+        finally:
+            os.umask(old_umask)
+        listener.listen(16)
+        if not globals.opts.foreground:
+            if os.fork() != 0:
+                print >>sys.stderr, "INFO: mrb depServer listening on", \
+                    globals.socket_name
+                os._exit(0)
+            self.detach()
+        signal.signal(signal.SIGTERM, raise_exit)
+        try:
+            self.serve(listener)
+        finally:
+            listener.close()
+            os.unlink(globals.socket_name)
+
+    def detach(self):
+        """Detach from the terminal and log to the log file."""
+        os.setsid()
+        null = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(null, 0)
+        os.close(null)
+        log = os.open(globals.log_file_name,
+            os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0600)
+        os.dup2(log, 1)
+        os.dup2(log, 2)
+        os.close(log)
+
+    def log(self, msg):
+        """Write a time stamped line to the log."""
+        print >>sys.stderr, "%s %s" % \
+            (time.strftime("%Y-%m-%d %H:%M:%S"), msg)
+        sys.stderr.flush()
+
+    def serve(self, listener):
+        """Answer requests until stopped or idle."""
+        self.log("INFO: serving %s" % globals.mrb_top)
+        idle = globals.opts.idle or None
+        while not self.stopping:
+            if not select.select([listener], [], [], idle)[0]:
+                self.log("INFO: idle, exiting")
+                return
+            (conn, addr) = listener.accept()
+            try:
+                try:
+                    conn.settimeout(30.0)
+                    self.answer(conn)
+                except socket.error, e:
+                    self.log("WARNING: lost a client: %s" % e)
+            finally:
+                conn.close()
+        self.log("INFO: stopped")
+
+    def answer(self, conn):
+        """Read one request from conn and answer it."""
+        inf = conn.makefile("rb")
+        request = inf.readline()
+        inf.close()
+        fields = request.rstrip("\n").split("\t")
+        self.queries += 1
+        outf = conn.makefile("wb", 65536)
+        try:
+            try:
+                lines = self.handle(fields)
+            except (IOError, OSError, ValueError), e:
+                self.log("ERROR: %s: %s" % (fields[0], e))
+                outf.write("ERROR: %s\n" % e)
+                return
+            outf.write("OK\n")
+            outf.writelines(lines)
+        finally:
+            outf.close()
+
+    def handle(self, fields):
+        """Return the lines answering a request."""
+        self.drop_missing_databases()
+        command = fields[0]
+        if (command == "consumers") and (len(fields) >= 4):
+            return self.consumers(fields[1], fields[2], fields[3:])
+        if (command == "used_by") and (len(fields) % 2 == 0):
+            return self.used_by(fields[1], fields[2:])
+        if (command == "status") and (len(fields) == 1):
+            return self.status()
+        if (command == "stop") and (len(fields) == 1):
+            self.stopping = True
+            return ["stopping\n"]
+        raise ValueError("bad request %r" % "\t".join(fields))
+
+    def check_database_name(self, filename, name):
+        """Raise ValueError unless filename is the database called name
+           of this development area."""
+        if os.path.basename(filename) == name:
+            dirname = os.path.dirname(os.path.abspath(filename))
+            mrb_top = os.path.abspath(globals.mrb_top)
+            if name == base_database_name:
+                if dirname == mrb_top:
+                    return
+            elif os.path.dirname(dirname) == mrb_top:
+                return
+            elif globals.mrb_build and \
+                    (dirname == os.path.abspath(globals.mrb_build)):
+                return
+        raise ValueError("%s is not the %s of %s" % (filename, name,
+            globals.mrb_top))
+
+    def drop_missing_databases(self):
+        """Forget the loaded databases whose files are gone."""
+        for filename in self.databases.keys():
+            if file_stamp(filename) is None:
+                del self.databases[filename]
+                self.log("INFO: dropped %s" % filename)
+
+    def database(self, filename, name):
+        """Return the database in filename, the database called name of
+           this development area, loading it if it was not loaded yet
+           or has changed since.  A missing file is an empty database,
+           which is not kept."""
+        self.check_database_name(filename, name)
+        stamp = file_stamp(filename)
+        if self.databases.has_key(filename):
+            if self.databases[filename][0] == stamp:
+                return self.databases[filename][1]
+            del self.databases[filename]
+        db = depDatabase.DEPENDENCY_DATABASE()
+        if stamp is None:
+            return db
+        start = time.time()
+        db.load(filename)
+        self.log("INFO: loaded %s in %.3f s" % \
+            (filename, time.time() - start))
+        self.databases[filename] = (stamp, db)
+        return db
+
+    def consumers(self, base_file, local_file, deps):
+        """Return the lines of the edges into deps of the local
+           database over the base database."""
+        return self.consumer_lines(
+            self.database(base_file, base_database_name),
+            self.database(local_file, local_database_name), deps)
+
+    def consumer_lines(self, base, local, deps):
+        """Generate the lines for consumers, after the databases have
+           been loaded, so that loading errors are reported in time."""
+        for dep in deps:
+            consumers = base.consumers_of(dep)
+            for pkg in consumers.keys():
+                if local.has_pkg(pkg):
+                    del consumers[pkg]
+            consumers.update(local.consumers_of(dep))
+            for pkg in sorted(consumers.keys()):
+                for dep_file in consumers[pkg]:
+                    yield "%s : %s : %s\n" % (pkg, dep, dep_file)
+
+    def used_by(self, objects_file, headers):
+        """Return the lines of the targets which use the headers, given
+           as pkg, dep_file pairs."""
+        objects = self.database(objects_file, objects_database_name)
+        found = {}
+        for i in range(0, len(headers), 2):
+            for target in objects.headers_used(headers[i], headers[i + 1]):
+                found[target] = 1
+        return ["%s\n" % x for x in sorted(found.keys())]
+
+    def status(self):
+        """Return the lines describing the server."""
+        result = ["pid %d\n" % os.getpid(),
+            "uptime %.0f s\n" % (time.time() - self.started),
+            "queries %d\n" % self.queries]
+        for filename in sorted(self.databases.keys()):
+            result.append("loaded %s\n" % filename)
+        return result
+
+if __name__ == "__main__":
+    # We are being run as a script.
+    system = SYSTEM()
+    system.run()
+else:
+    # We are being loaded as a module.
+    pass
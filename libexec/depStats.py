@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# vim: ts=4 expandtab sw=4
+
+"""Phase timing and counters for the dependency tools."""
+
+
+# Used by makeDep.py and pullDep.py for their --stats and --profile
+# options.  A STATS object does nothing until it is started, so the
+# tools can call it unconditionally outside of their inner loops.
+
+import os
+import sys
+import time
+
+# Force the python version to be at least 2.4.x, which is
+# the version available in SLF5.x distributions (actually
+# they all ship with 2.4.3, and just for reference, all
+# of the SLF6.x distributions ship with 2.6.6).
+if (sys.version_info[0] < 2) or ((sys.version_info[0] == 2) and \
+        (sys.version_info[1] < 4)):
+    print >>sys.stderr, "ERROR: Python version must be at least 2.4!"
+    sys.exit(1)
+
+# The json report needs at least python 2.6.
+try:
+    import json
+except ImportError:
+    json = None
+
+# Peak RSS is only available on Unix.
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# cProfile needs at least python 2.5, fall back to the slower profile.
+try:
+    import cProfile as profile
+except ImportError:
+    try:
+        import profile
+    except ImportError:
+        profile = None
+
+stats_formats = ["text", "json"]
+
+def add_options(p):
+    """Add the --stats, --stats-file and --profile options to p."""
+    p.set_defaults(stats=None, stats_file=None, profile_file=None)
+    p.add_option("--stats", dest="stats", type="choice",
+        choices=stats_formats, metavar="FORMAT",
+        help="report the wall and cpu time of each phase and what " + \
+        "was done, as text or json, --stats alone means text")
+    p.add_option("--stats-file", dest="stats_file", metavar="FILE",
+        help="write the --stats report to FILE instead of stderr")
+    p.add_option("--profile", dest="profile_file", metavar="FILE",
+        help="run under cProfile and dump the profile to FILE")
+
+def command_line(argv):
+    """Return argv with a bare --stats made into --stats=text, optparse
+       has no options with an optional value."""
+    return [((x == "--stats") and "--stats=text") or x for x in argv]
+
+def check_options(p, opts):
+    """Check the options added by add_options."""
+    if (opts.stats == "json") and (json is None):
+        p.error("--stats=json needs the json module (python 2.6)")
+    if opts.profile_file and (profile is None):
+        p.error("--profile needs the cProfile or profile module")
+
+def cpu_time():
+    """Return the cpu time used by us and our finished children."""
+    t = os.times()
+    return t[0] + t[1] + t[2] + t[3]
+
+class STATS:
+    """Phase timings and counters of one run of a tool."""
+
+    def __init__(self, tool):
+        """Constructor."""
+        self.tool = tool
+        self.enabled = False
+        self.opts = None
+        # Phase names in the order they first ran, and
+        # { name : [calls, wall, cpu] }.
+        self.phase_names = []
+        self.phases = {}
+        # { name : count } or { name : { key : count } }.
+        self.counters = {}
+        self.profiler = None
+        self.start_wall = time.time()
+        self.start_cpu = cpu_time()
+
+    def start(self, opts):
+        """Start collecting if the options ask for it."""
+        self.opts = opts
+        self.enabled = bool(opts.stats)
+        if opts.profile_file:
+            self.profiler = profile.Profile()
+            self.profiler.enable()
+
+    def time_phase(self, name, func, *args):
+        """Call func(*args) and add its time to phase name."""
+        if not self.enabled:
+            return func(*args)
+        wall = time.time()
+        cpu = cpu_time()
+        try:
+            return func(*args)
+        finally:
+            if not self.phases.has_key(name):
+                self.phase_names.append(name)
+                self.phases[name] = [0, 0.0, 0.0]
+            phase = self.phases[name]
+            phase[0] += 1
+            phase[1] += time.time() - wall
+            phase[2] += cpu_time() - cpu
+
+    def count(self, name, n=1):
+        """Add n to counter name."""
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def count_key(self, name, key, n=1):
+        """Add n to the key entry of counter name."""
+        if self.enabled:
+            if not self.counters.has_key(name):
+                self.counters[name] = {}
+            counter = self.counters[name]
+            counter[key] = counter.get(key, 0) + n
+
+    def merge(self, counters):
+        """Add the counters collected by a worker process."""
+        for (name, value) in counters.items():
+            if isinstance(value, dict):
+                for (key, n) in value.items():
+                    self.count_key(name, key, n)
+            else:
+                self.count(name, value)
+
+    def peak_rss(self):
+        """Return the peak RSS in kB of us and of our largest child,
+           or None if it is not known."""
+        if resource is None:
+            return (None, None)
+        # Note: ru_maxrss is in bytes on macOS, kB elsewhere.
+        scale = 1
+        if sys.platform == "darwin":
+            scale = 1024
+        return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale)
+
+    def report_data(self):
+        """Return the report as a dictionary."""
+        (rss, children_rss) = self.peak_rss()
+        return {
+            "tool" : self.tool,
+            "phases" : [ { "name" : x, "calls" : self.phases[x][0],
+                "wall" : self.phases[x][1], "cpu" : self.phases[x][2] }
+                for x in self.phase_names ],
+            "total" : { "wall" : time.time() - self.start_wall,
+                "cpu" : cpu_time() - self.start_cpu },
+            "counters" : self.counters,
+            "peak_rss_kb" : rss,
+            "children_peak_rss_kb" : children_rss }
+
+    def write_text_report(self, outf, data):
+        """Write the report as a table."""
+        print >>outf, "%s statistics:" % data["tool"]
+        print >>outf, "  %-32s %6s %10s %10s" % ("phase", "calls",
+            "wall s", "cpu s")
+        for phase in data["phases"]:
+            print >>outf, "  %-32s %6d %10.3f %10.3f" % (phase["name"],
+                phase["calls"], phase["wall"], phase["cpu"])
+        print >>outf, "  %-32s %6s %10.3f %10.3f" % ("total", "",
+            data["total"]["wall"], data["total"]["cpu"])
+        if data["counters"]:
+            print >>outf, "  counters:"
+        for name in sorted(data["counters"].keys()):
+            value = data["counters"][name]
+            if not isinstance(value, dict):
+                print >>outf, "    %-38s %10d" % (name, value)
+                continue
+            print >>outf, "    %s:" % name
+            for key in sorted(value.keys()):
+                print >>outf, "      %-36s %10d" % (key, value[key])
+        if data["peak_rss_kb"] is not None:
+            print >>outf, "  peak RSS: %d kB, largest child: %d kB" % \
+                (data["peak_rss_kb"], data["children_peak_rss_kb"])
+
+    def finish(self):
+        """Dump the profile and write the report, if asked for."""
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.opts.profile_file)
+            self.profiler = None
+        if not self.enabled:
+            return
+        self.enabled = False
+        data = self.report_data()
+        if self.opts.stats_file:
+            outf = open(self.opts.stats_file, "w")
+        else:
+            outf = sys.stderr
+        if self.opts.stats == "json":
+            json.dump(data, outf, indent=2, sort_keys=True)
+            outf.write("\n")
+        else:
+            self.write_text_report(outf, data)
+        if outf is not sys.stderr:
+            outf.close()
@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# vim: ts=4 expandtab sw=4
+
+"""Compare two dependency databases."""
+
+
+# Prints the edges which were added to or removed from the new
+# database, grouped by package, for instance after moving to a new
+# release:
+#
+#   + art : cetlib : cetlib/exempt_ptr.h
+#   - art : fhiclcpp : fhiclcpp/ParameterSet.h
+#   art : 1 added, 1 removed, no longer uses fhiclcpp
+#
+# Both databases are read as sorted streams, in the text or the
+# compact format (see depDatabase.py), so only the edges of one
+# package are held in memory at a time.
+
+import depDatabase
+import optparse
+import sys
+
+# Force the python version to be at least 2.4.x, which is
+# the version available in SLF5.x distributions (actually
+# they all ship with 2.4.3, and just for reference, all
+# of the SLF6.x distributions ship with 2.6.6).
+if (sys.version_info[0] < 2) or ((sys.version_info[0] == 2) and \
+        (sys.version_info[1] < 4)):
+    print >>sys.stderr, "ERROR: Python version must be at least 2.4!"
+    sys.exit(1)
+
+# The json report needs at least python 2.6.
+try:
+    import json
+except ImportError:
+    json = None
+
+class PKG_DIFF:
+    """The differences in the edges of one package."""
+
+    def __init__(self, pkg):
+        """Constructor."""
+        self.pkg = pkg
+        # (dep, dep_file) pairs in sorted order, with the sign of
+        # each, -1 for removed and 1 for added.
+        self.edges = []
+        self.added = 0
+        self.removed = 0
+        # Deps which the package started or stopped using.
+        self.deps_added = []
+        self.deps_removed = []
+
+    def add(self, sign, dep, dep_file):
+        """Record an edge only in one of the databases."""
+        self.edges.append((sign, dep, dep_file))
+        if sign > 0:
+            self.added += 1
+        else:
+            self.removed += 1
+
+    def summary(self):
+        """Return the one line summary of the package."""
+        result = "%s : %d added, %d removed" % (self.pkg, self.added,
+            self.removed)
+        if self.deps_added:
+            result += ", now uses %s" % " ".join(self.deps_added)
+        if self.deps_removed:
+            result += ", no longer uses %s" % " ".join(self.deps_removed)
+        return result
+
+    def report_data(self):
+        """Return the package as a dictionary for the json report."""
+        return {
+            "pkg" : self.pkg,
+            "added" : [ [x[1], x[2]] for x in self.edges if x[0] > 0 ],
+            "removed" : [ [x[1], x[2]] for x in self.edges if x[0] < 0 ],
+            "deps_added" : self.deps_added,
+            "deps_removed" : self.deps_removed }
+
+class GLOBALS:
+    """Global variables container."""
+
+    def __init__(self):
+        """Constructor."""
+        # Results of parsing the command line.
+        self.opts = None
+        self.args = None
+
+    def parse_options(self):
+        """Parse the command line."""
+        descrip="Print the include edges which were added to or " + \
+                "removed from a dependency database, grouped by " + \
+                "package, with a summary of each package.  Either " + \
+                "database may be in the text or the compact format."
+        usage="%prog [options] <old> <new>"
+        p = optparse.OptionParser(usage=usage, description=descrip)
+        p.set_defaults(summary=False, json_file=None)
+        p.add_option("-s", "--summary", dest="summary", action="store_true",
+            help="print only the summary of each package")
+        p.add_option("--json", dest="json_file", metavar="FILE",
+            help="also write the differences as json to FILE, " + \
+            "- for standard output instead of the text report")
+        (self.opts, self.args) = p.parse_args()
+        if len(self.args) != 2:
+            p.error("wrong number of arguments")
+        if self.opts.json_file and (json is None):
+            p.error("--json needs the json module (python 2.6)")
+
+# Create an object to contain global variables.
+globals = GLOBALS()
+
+class SYSTEM:
+    """Master Controller."""
+
+    def __init__(self):
+        """Constructor."""
+        self.outf = sys.stdout
+        self.json_outf = None
+        self.changed_pkgs = 0
+        self.added = 0
+        self.removed = 0
+
+    def run(self):
+        """Entry Point."""
+        globals.parse_options()
+        (old, new) = globals.args
+        if globals.opts.json_file == "-":
+            self.outf = None
+            self.json_outf = sys.stdout
+        elif globals.opts.json_file:
+            self.json_outf = open(globals.opts.json_file, "w")
+        if self.json_outf is not None:
+            self.json_outf.write("{\n  \"old\" : %s,\n  \"new\" : %s,\n" \
+                "  \"packages\" : [" % (json.dumps(old), json.dumps(new)))
+        try:
+            self.diff(old, new)
+        except depDatabase.UNSORTED_DATABASE, e:
+            print >>sys.stderr, "ERROR:", e
+            print >>sys.stderr, "       sort it with " + \
+                "depDatabase.py -f text <database> <output>"
+            sys.exit(1)
+        if self.outf is not None:
+            print >>self.outf, "total : %d packages changed, " \
+                "%d added, %d removed" % (self.changed_pkgs, self.added,
+                self.removed)
+        if self.json_outf is not None:
+            self.json_outf.write("\n  ],\n  \"totals\" : %s\n}\n" % \
+                json.dumps({ "packages" : self.changed_pkgs,
+                "added" : self.added, "removed" : self.removed },
+                sort_keys=True))
+            if self.json_outf is not sys.stdout:
+                self.json_outf.close()
+
+    def diff(self, old, new):
+        """Report the differences between the databases old and new,
+           package by package."""
+        pkg_diff = None
+        dep_key = None
+        for (sign, (pkg, dep, dep_file)) in depDatabase.diff_edges(
+                depDatabase.iter_database_edges(old),
+                depDatabase.iter_database_edges(new)):
+            if (pkg, dep) != dep_key:
+                if dep_key is not None:
+                    self.end_dep(pkg_diff, dep_key[1], old_n, new_n)
+                if (pkg_diff is None) or (pkg != pkg_diff.pkg):
+                    if pkg_diff is not None:
+                        self.end_pkg(pkg_diff)
+                    pkg_diff = PKG_DIFF(pkg)
+                dep_key = (pkg, dep)
+                old_n = 0
+                new_n = 0
+            if sign <= 0:
+                old_n += 1
+            if sign >= 0:
+                new_n += 1
+            if sign != 0:
+                pkg_diff.add(sign, dep, dep_file)
+        if dep_key is not None:
+            self.end_dep(pkg_diff, dep_key[1], old_n, new_n)
+            self.end_pkg(pkg_diff)
+
+    def end_dep(self, pkg_diff, dep, old_n, new_n):
+        """Note whether the package started or stopped using dep."""
+        if old_n == 0:
+            pkg_diff.deps_added.append(dep)
+        elif new_n == 0:
+            pkg_diff.deps_removed.append(dep)
+
+    def end_pkg(self, pkg_diff):
+        """Report the differences of one package."""
+        if not pkg_diff.edges:
+            return
+        if self.json_outf is not None:
+            if self.changed_pkgs:
+                self.json_outf.write(",")
+            self.json_outf.write("\n    %s" % \
+                json.dumps(pkg_diff.report_data(), sort_keys=True))
+        self.changed_pkgs += 1
+        self.added += pkg_diff.added
+        self.removed += pkg_diff.removed
+        if self.outf is None:
+            return
+        if not globals.opts.summary:
+            for (sign, dep, dep_file) in pkg_diff.edges:
+                print >>self.outf, "%s %s : %s : %s" % \
+                    ((sign > 0 and "+") or "-", pkg_diff.pkg, dep, dep_file)
+        print >>self.outf, pkg_diff.summary()
+
+if __name__ == "__main__":
+    # We are being run as a script.
+    system = SYSTEM()
+    system.run()
+else:
+    # We are being loaded as a module.
+    pass
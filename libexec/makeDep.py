@@ -6,13 +6,29 @@
 
 # run this from the build directory
 # creates $MRB_BUILDDIR/.dependency_database
+# and its scan cache $MRB_BUILDDIR/.dependency_database.cache
+# and with --objects $MRB_BUILDDIR/.dependency_database.objects
 # To use a temporary database as a base database, 
 # copy it to $MRB_INSTALL/.base_dependency_database
+# (remove that first, it may be a link to a shared read-only copy)
 
+import depDatabase
+import depStats
+import errno
 import optparse
 import os
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
 import re
+import select
+import shlex
+import signal
+import struct
+import subprocess
 import sys
+import time
 
 # Force the python version to be at least 2.4.x, which is
 # the version available in SLF5.x distributions (actually
@@ -23,6 +39,375 @@ if (sys.version_info[0] < 2) or ((sys.version_info[0] == 2) and \
     print >>sys.stderr, "ERROR: Python version must be at least 2.4!"
     sys.exit(1)
 
+# The process pool needs at least python 2.6, without it
+# we always scan serially.
+try:
+    import multiprocessing
+except ImportError:
+    multiprocessing = None
+
+# Reading compile_commands.json needs at least python 2.6.
+try:
+    import json
+except ImportError:
+    json = None
+
+# Watching the build area with inotify needs ctypes (python 2.6
+# for errno support) and Linux.
+try:
+    import ctypes
+    import ctypes.util
+except ImportError:
+    ctypes = None
+
+# Use scandir when it is available (builtin since python 3.5,
+# or the scandir module), it saves a stat call per entry.
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+def list_dir(dirname):
+    """Return a sorted list of (name, is_dir) pairs for the
+       entries of dirname."""
+    if scandir is not None:
+        entries = [(x.name, x.is_dir()) for x in scandir(dirname)]
+    else:
+        entries = [(x, os.path.isdir(os.path.join(dirname, x))) \
+            for x in os.listdir(dirname)]
+        globals.stats.count("stat_calls", len(entries))
+    globals.stats.count("dirs_listed")
+    entries.sort()
+    return entries
+
+def merge_deps(pkgdepends, file_deps):
+    """Merge the { dep : { dep_file : 1 } } info of one dependency
+       file into the info for its package."""
+    for dep in file_deps.keys():
+        if not pkgdepends.has_key(dep):
+            pkgdepends[dep] = file_deps[dep].copy()
+        else:
+            pkgdepends[dep].update(file_deps[dep])
+
+# Dependency sources which can be selected with -s.
+dep_source_names = ["auto", "make", "ninja", "depfile"]
+
+# Names of the make format dependency files written by the cmake
+# Unix Makefiles generator (compiler_depend.make since cmake 3.20).
+make_dep_file_names = ["depend.make", "compiler_depend.make"]
+
+pat_make_rule = re.compile(r"(.+?):(?:\s+|$)")
+pat_make_space = re.compile(r"(?<!\\)\s+")
+
+def read_make_deps(filename):
+    """Generate 'target: prerequisite' lines from a make format
+       dependency file (depend.make or a compiler .d file), one
+       line per prerequisite, reading the file a line at a time."""
+    inf = open(filename, "r")
+    rule = ""
+    for line in inf:
+        if (not rule) and ("#" == line[0]):
+            # Skip comment lines.
+            continue
+        line = line.rstrip("\r\n")
+        if line.endswith("\\"):
+            # Continued on the next line.
+            rule += line[:-1] + " "
+            continue
+        rule += line
+        res = pat_make_rule.match(rule)
+        if res:
+            target = res.group(1).strip()
+            prereqs = rule[res.end():]
+            if "\\" in prereqs:
+                # Some prerequisites contain escaped blanks.
+                prereqs = [x.replace("\\ ", " ").replace("\\#", "#") \
+                    for x in pat_make_space.split(prereqs.strip())]
+            else:
+                prereqs = prereqs.split()
+            for prereq in prereqs:
+                if prereq:
+                    yield "%s: %s" % (target, prereq.replace("$$", "$"))
+        rule = ""
+    inf.close()
+
+class NINJA_DEPS_ERROR(Exception):
+    """The ninja deps log could not be read."""
+
+def read_ninja_deps(build_dir):
+    """Generate (target, 'target: prerequisite') pairs from the ninja
+       deps log of build_dir, streamed from the output of
+       ninja -t deps.  Raise NINJA_DEPS_ERROR if it cannot be read."""
+    try:
+        proc = subprocess.Popen(["ninja", "-C", build_dir, "-t", "deps"],
+            stdout=subprocess.PIPE, universal_newlines=True)
+    except OSError:
+        raise NINJA_DEPS_ERROR("Unable to run ninja -t deps in %s" % \
+            build_dir)
+    target = None
+    for line in proc.stdout:
+        if not line.strip():
+            # Blank line ends the deps of a target.
+            target = None
+        elif not line[0].isspace():
+            # Start of the deps of a target:
+            # <target>: #deps <n>, deps mtime <t> (VALID|STALE)
+            idx = line.find(": #deps")
+            if idx < 0:
+                target = None
+            else:
+                target = line[:idx]
+        elif target is not None:
+            yield (target, "%s: %s" % (target, line.strip()))
+    proc.stdout.close()
+    if proc.wait() != 0:
+        raise NINJA_DEPS_ERROR("ninja -t deps failed in %s" % build_dir)
+
+def strongly_connected_components(nodes, uses):
+    """Return the strongly connected components of the graph in which
+       node x has edges to the nodes in uses[x], each as a sorted list.
+       A component comes after all the components it uses."""
+    # Tarjan's algorithm, with an explicit stack instead of recursion.
+    index = {}
+    low = {}
+    stack = []
+    on_stack = {}
+    comps = []
+    for root in nodes:
+        if index.has_key(root):
+            continue
+        work = [(root, 0)]
+        while work:
+            (node, i) = work.pop()
+            if i == 0:
+                index[node] = low[node] = len(index)
+                stack.append(node)
+                on_stack[node] = 1
+            succ = uses[node]
+            descend = False
+            while i < len(succ):
+                w = succ[i]
+                i += 1
+                if not index.has_key(w):
+                    work.append((node, i))
+                    work.append((w, 0))
+                    descend = True
+                    break
+                if on_stack.has_key(w):
+                    low[node] = min(low[node], index[w])
+            if descend:
+                continue
+            if low[node] == index[node]:
+                comp = []
+                while True:
+                    w = stack.pop()
+                    del on_stack[w]
+                    comp.append(w)
+                    if w == node:
+                        break
+                comp.sort()
+                comps.append(comp)
+            if work:
+                parent = work[-1][0]
+                low[parent] = min(low[parent], low[node])
+    return comps
+
+def dot_quote(name):
+    """Return name as a quoted DOT identifier."""
+    return '"%s"' % name.replace("\\", "\\\\").replace('"', '\\"')
+
+json_space_pat = re.compile(r"[ \t\n\r]*")
+
+def read_json_objects(inf, chunk_size=65536):
+    """Generate the objects of the JSON array read from file inf one
+       at a time, so that only the object being decoded and a chunk
+       of the file are held in memory, not the whole array."""
+    decoder = json.JSONDecoder()
+    buf = ""
+    pos = 0
+    eof = False
+    # What comes next: the "[", the first object or "]", a "," or
+    # "]", or an object.
+    expect = "["
+    while True:
+        pos = json_space_pat.match(buf, pos).end()
+        if (pos == len(buf)) or (expect == "object"):
+            if (pos == len(buf)) and eof:
+                raise ValueError("unexpected end of JSON array")
+            if expect == "object":
+                decoded = True
+                try:
+                    (obj, pos) = decoder.raw_decode(buf, idx=pos)
+                except ValueError:
+                    # Incomplete, unless there is no more to read.
+                    if eof:
+                        raise
+                    decoded = False
+                if decoded:
+                    if not isinstance(obj, dict):
+                        raise ValueError("expected a JSON object")
+                    yield obj
+                    expect = ","
+                    continue
+            # Keep the rest and read more, at least as much again
+            # for an object longer than a chunk.
+            buf = buf[pos:]
+            pos = 0
+            more = inf.read(max(chunk_size, len(buf)))
+            if not more:
+                eof = True
+            buf += more
+            continue
+        c = buf[pos]
+        pos += 1
+        if expect == "[":
+            if c != "[":
+                raise ValueError("expected a JSON array")
+            expect = "first"
+        elif c == "]":
+            if expect in ("first", ","):
+                return
+            raise ValueError("expected a JSON object")
+        elif expect == "first":
+            pos -= 1
+            expect = "object"
+        elif c == ",":
+            expect = "object"
+        else:
+            raise ValueError("expected , or ] in JSON array")
+
+def read_compile_commands(filename):
+    """Generate (directory, depfile) pairs for the compiler
+       dependency files named by the entries of a
+       compile_commands.json file, decoding one entry at a time."""
+    inf = open(filename, "r")
+    try:
+        for entry in read_json_objects(inf):
+            pair = compile_command_depfile(entry)
+            if pair is not None:
+                yield pair
+    finally:
+        inf.close()
+
+def compile_command_depfile(entry):
+    """Return the (directory, depfile) pair for the compiler
+       dependency file of a compile_commands.json entry, or None if
+       the compile writes none."""
+    directory = entry.get("directory", "")
+    args = entry.get("arguments")
+    if args is None:
+        args = shlex.split(entry.get("command", ""))
+    depfile = None
+    obj = entry.get("output")
+    write_deps = False
+    for i in range(len(args)):
+        arg = args[i]
+        if (arg == "-MF") and (i + 1 < len(args)):
+            depfile = args[i + 1]
+        elif arg.startswith("-MF"):
+            depfile = arg[3:]
+        elif (arg == "-o") and (i + 1 < len(args)):
+            obj = args[i + 1]
+        elif arg in ("-MD", "-MMD"):
+            write_deps = True
+    if (depfile is None) and write_deps and obj:
+        # The compiler default, the object name with a .d suffix.
+        depfile = os.path.splitext(obj)[0] + ".d"
+    if depfile is None:
+        return None
+    return (directory, os.path.join(directory, depfile))
+
+class INOTIFY:
+    """Recursive inotify watch on a directory tree."""
+
+    # Event masks from <sys/inotify.h>.
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+    IN_ISDIR = 0x40000000
+    watch_mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | \
+        IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ONLYDIR
+    event_header = "iIII"
+    event_header_size = struct.calcsize(event_header)
+
+    def __init__(self):
+        """Constructor."""
+        libc_name = ctypes.util.find_library("c") or "libc.so.6"
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.fd = self.libc.inotify_init()
+        if self.fd < 0:
+            self.raise_errno("inotify_init")
+        # { watch descriptor : directory }
+        self.dirs = {}
+
+    def raise_errno(self, what, path=None):
+        """Raise an OSError for a failed libc call."""
+        err = ctypes.get_errno()
+        raise OSError(err, "%s: %s" % (what, os.strerror(err)), path)
+
+    def close(self):
+        """Stop watching."""
+        os.close(self.fd)
+
+    def add_tree(self, top):
+        """Watch top and every directory below it, returning the
+           files found in them."""
+        files = []
+        for (dirpath, dirnames, filenames) in os.walk(top):
+            wd = self.libc.inotify_add_watch(self.fd, dirpath,
+                self.watch_mask)
+            if wd < 0:
+                if ctypes.get_errno() == 2:
+                    # Removed while we were walking.
+                    continue
+                self.raise_errno("inotify_add_watch", dirpath)
+            self.dirs[wd] = dirpath
+            files.extend([os.path.join(dirpath, x) for x in filenames])
+        return files
+
+    def read_events(self, timeout):
+        """Wait up to timeout seconds (forever if None) and return
+           the (path, mask) of the events read."""
+        try:
+            ready = select.select([self.fd], [], [], timeout)[0]
+        except select.error, e:
+            if e[0] == 4:
+                # Interrupted by a signal.
+                return []
+            raise
+        if not ready:
+            return []
+        data = os.read(self.fd, 65536)
+        events = []
+        pos = 0
+        while pos + self.event_header_size <= len(data):
+            (wd, mask, cookie, name_len) = struct.unpack(self.event_header,
+                data[pos:pos + self.event_header_size])
+            pos += self.event_header_size
+            name = data[pos:pos + name_len].rstrip("\0")
+            pos += name_len
+            if mask & self.IN_Q_OVERFLOW:
+                events.append((None, mask))
+                continue
+            dirpath = self.dirs.get(wd)
+            if dirpath is None:
+                continue
+            if mask & self.IN_IGNORED:
+                # The directory is gone.
+                del self.dirs[wd]
+                continue
+            events.append((os.path.join(dirpath, name), mask))
+        return events
+
 class GLOBALS:
     """Global variables container."""
 
@@ -52,6 +437,15 @@ class GLOBALS:
             ".dependency_database")
         self.project_dep_file_name = os.path.join(self.mrb_install, \
             ".base_dependency_database")
+        self.dep_cache_file_name = self.dep_file_name + ".cache"
+        self.object_dep_file_name = self.dep_file_name + ".objects"
+        self.ninja_deps_file_name = os.path.join(self.mrb_build, \
+            ".ninja_deps")
+        self.compile_commands_file_name = os.path.join(self.mrb_build, \
+            "compile_commands.json")
+        # Bump this when the layout of the cache changes.
+        self.dep_cache_version = 2
+        self.stats = depStats.STATS("makeDep.py")
         #print >>sys.stderr, "DEBUG: opts:", self.opts
         #print >>sys.stderr, "DEBUG: args:", self.args
         #print >>sys.stderr, "DEBUG: MRB_SOURCE:", globals.mrb_source
@@ -69,11 +463,82 @@ class GLOBALS:
                 "information from the cmake dependency files created in " + \
                 "the build area during a build."
         p = optparse.OptionParser(description=descrip)
-        p.set_defaults(do_nothing=False)
+        p.set_defaults(do_nothing=False, jobs=1, full_rescan=False,
+            sources=[], format="text", watch=False, settle=0.5,
+            interval=5.0, graph_file=None, graph_format=None,
+            objects=False)
         p.add_option("-n", dest="do_nothing", action="store_true",
             help="do nothing")
-        (self.opts, self.args) = p.parse_args()
+        p.add_option("-j", dest="jobs", type="int", metavar="N",
+            help="scan N package build directories in parallel [%default]")
+        p.add_option("--full", dest="full_rescan", action="store_true",
+            help="ignore the scan cache and rescan every dependency file")
+        p.add_option("-f", "--format", dest="format", type="choice",
+            choices=["text", "compact"],
+            help="format of the database, text or compact [%default]")
+        p.add_option("-s", "--source", dest="sources", action="append",
+            type="choice", choices=dep_source_names, metavar="SOURCE",
+            help="where to read dependencies from, one of " + \
+            ", ".join(dep_source_names) + ", may be repeated: " + \
+            "make reads the depend.make files of the Unix Makefiles " + \
+            "generator, ninja reads the ninja deps log, depfile " + \
+            "reads the compiler .d files named in " + \
+            "compile_commands.json (decoded an entry at a time, " + \
+            "memory does not grow with its size), auto (the " + \
+            "default) chooses ninja if there is a ninja deps log " + \
+            "in the build area, otherwise make")
+        p.add_option("--watch", dest="watch", action="store_true",
+            help="after the scan, keep watching the build area and " + \
+            "update the database as the build writes dependency " + \
+            "files, until interrupted (Linux only)")
+        p.add_option("--settle", dest="settle", type="float",
+            metavar="SECS",
+            help="with --watch, update once there have been no " + \
+            "changes for SECS seconds [%default]")
+        p.add_option("--interval", dest="interval", type="float",
+            metavar="SECS",
+            help="with --watch, update at least every SECS seconds " + \
+            "during a build, or scan every SECS seconds if the " + \
+            "build area cannot be watched [%default]")
+        p.add_option("--objects", dest="objects", action="store_true",
+            help="also write the object level database, which " + \
+            "records which objects include each header of a local or " + \
+            "base pkg, for checkDeps --rebuild-set")
+        p.add_option("--emit-graph", dest="graph_file", metavar="FILE",
+            help="also write the graph of the local pkgs in the build " + \
+            "area to FILE, with topological levels, a critical path " + \
+            "and dependency cycles")
+        p.add_option("--graph-format", dest="graph_format", type="choice",
+            choices=["dot", "json"], metavar="FORMAT",
+            help="format of the --emit-graph file, dot or json " + \
+            "[json if FILE ends with .json, otherwise dot]")
+        depStats.add_options(p)
+        (self.opts, self.args) = \
+            p.parse_args(depStats.command_line(sys.argv[1:]))
         #print >>sys.stderr, "DEBUG: do_nothing:", self.opts.do_nothing
+        if self.opts.jobs < 1:
+            p.error("-j must be at least 1")
+        if (not self.opts.sources) or ("auto" in self.opts.sources):
+            if os.path.exists(self.ninja_deps_file_name):
+                self.opts.sources.append("ninja")
+            else:
+                self.opts.sources.append("make")
+        if ("depfile" in self.opts.sources) and (json is None):
+            p.error("-s depfile needs the json module (python 2.6)")
+        if self.opts.watch and ((ctypes is None) or \
+                (not sys.platform.startswith("linux"))):
+            p.error("--watch needs Linux and the ctypes module (python 2.6)")
+        if (self.opts.settle <= 0) or (self.opts.interval <= 0):
+            p.error("--settle and --interval must be positive")
+        if self.opts.graph_file and (not self.opts.graph_format):
+            if self.opts.graph_file.endswith(".json"):
+                self.opts.graph_format = "json"
+            else:
+                self.opts.graph_format = "dot"
+        if (self.opts.graph_format == "json") and (json is None):
+            p.error("--graph-format json needs the json module (python 2.6)")
+        depStats.check_options(p, self.opts)
+        self.stats.start(self.opts)
 
 # Create an object to contain global variables.
 globals = GLOBALS()
@@ -84,16 +549,29 @@ class SYSTEM:
     def __init__(self):
         """Constructor."""
         #print >>sys.stderr, "DEBUG: System initializing."
-        # Project dependency database.
-        self.project_deps = {}
+        # Pkgs which have edges in the project dependency database.
+        self.project_pkgs = []
         # Local dependency database.
         self.local_deps = {}
-        # Combined project and local dependency database.
-        self.deps = {}
         # Local package information.
         self.local_pkgs = {}
-        # Patterns for matching base pkgs.
-        self.pat_base_pkgs = []
+        # Product dir each base pkg was found in.
+        self.base_pkg_dirs = {}
+        # Combined pattern for matching base pkgs.
+        self.pat_base_pkgs = None
+        # Scan cache from the previous run, and the one for this run,
+        # { filename : ((mtime, size), { dep : { dep_file : 1 } },
+        #   { dep : { dep_file : { target : 1 } } } or None) },
+        # the last is only collected with --objects.
+        self.file_cache = {}
+        self.new_file_cache = {}
+        # Pkg each compiler dependency file named in
+        # compile_commands.json belongs to.
+        self.depfile_pkgs = {}
+        # Dependency info from the ninja deps log, { pkg : deps },
+        # and with --objects its { dep : { dep_file : { target : 1 } } }.
+        self.ninja_deps = {}
+        self.ninja_objects = None
 
     def run(self):
         """Entry Point."""
@@ -101,65 +579,67 @@ class SYSTEM:
         globals.parse_options()
         if globals.opts.do_nothing:
             return
-        self.load_project_dependency_database()
-        #print >>sys.stderr, "DEBUG: project_deps:", self.project_deps
-        self.get_list_of_local_pkgs()
-        #print >>sys.stderr, "DEBUG: local_pkgs:", self.local_pkgs
-        self.make_base_pkgs_pats()
-        #print >>sys.stderr, "DEBUG: pat_base_pkgs:", self.pat_base_pkgs
-        self.scan_local_dependencies()
-        #print >>sys.stderr, "DEBUG: deps:", self.deps
-        self.deps = self.project_deps
-        # Combine the project and local dependency databases.
-        self.deps.update(self.local_deps)
-        #print >>sys.stderr, "DEBUG: deps:", self.deps
-        self.write_local_dependency_database()
+        stats = globals.stats
+        try:
+            stats.time_phase("load base database",
+                self.load_project_dependency_database)
+            #print >>sys.stderr, "DEBUG: project_pkgs:", self.project_pkgs
+            stats.time_phase("list local packages",
+                self.get_list_of_local_pkgs)
+            #print >>sys.stderr, "DEBUG: local_pkgs:", self.local_pkgs
+            stats.time_phase("build patterns", self.make_base_pkgs_pats)
+            #print >>sys.stderr, "DEBUG: pat_base_pkgs:", self.pat_base_pkgs
+            stats.time_phase("load scan cache", self.load_dependency_cache)
+            try:
+                self.scan_local_dependencies()
+            except NINJA_DEPS_ERROR, e:
+                print >>sys.stderr, "ERROR:", e
+                sys.exit(1)
+            #print >>sys.stderr, "DEBUG: local_deps:", self.local_deps
+            stats.time_phase("merge and write database",
+                self.write_local_dependency_database)
+            stats.time_phase("write scan cache", self.write_dependency_cache)
+            if globals.opts.objects:
+                stats.time_phase("write object database",
+                    self.write_object_dependency_database)
+            if globals.opts.graph_file:
+                stats.time_phase("emit graph", self.emit_package_graph)
+            if globals.opts.watch:
+                self.watch()
+        finally:
+            stats.finish()
 
     def load_project_dependency_database(self):
-        """Get the base dependency database."""
-        self.project_deps = {}
+        """Get the pkgs of the base dependency database, its edges are
+           streamed when the local database is written."""
+        self.project_pkgs = []
         if not os.path.exists(globals.project_dep_file_name):
             # Note: This is not an error because we get here
             #       when we are creating the project dependency
             #       database itself.
             return
-        inf = open(globals.project_dep_file_name, "r")
-        for line in inf:
-            #print >>sys.stderr, "DEBUG:", line,
-            (pkg, dep, dep_file) = line.split(":")
-            pkg = pkg.strip()
-            dep = dep.strip()
-            dep_file = dep_file.strip()
-            #print >>sys.stderr, "DEBUG: '%s' : '%s' : '%s'" % \
-            #    (pkg, dep, dep_file)
-            if not self.project_deps.has_key(pkg):
-                self.project_deps[pkg] = { dep : { dep_file : 1 } }
-            else:
-                if not self.project_deps[pkg].has_key(dep):
-                    self.project_deps[pkg][dep] = { dep_file : 1 }
-                else:
-                    self.project_deps[pkg][dep][dep_file] = 1
-        inf.close()
+        self.project_pkgs = \
+            depDatabase.database_packages(globals.project_dep_file_name)
 
     def get_list_of_local_pkgs(self):
         """Make a list of local pkgs."""
-        curdir = os.getcwd()
-        os.chdir(globals.mrb_source)
-        for nm in sorted(os.listdir(".")):
-            if not os.path.isdir(nm):
+        for (nm, is_dir) in list_dir(globals.mrb_source):
+            if not is_dir:
                 # Skip ordinary files.
                 continue;
+            if nm.startswith("."):
+                # Skip .locks and the like.
+                continue
             # This is a package source directory.
             self.local_pkgs[nm] = 1
-        os.chdir(curdir)
 
     def make_base_pkgs_pats(self):
-        """Create regex patterns for matching base pkgs."""
+        """Create a single regex pattern for matching base pkgs."""
         local_pkgs = self.local_pkgs.keys()
         local_pkgs.sort()
-        self.pat_base_pkgs = {}
+        self.base_pkg_dirs = {}
         for prod_dir in globals.product_dirs:
-            for pkg in sorted(self.project_deps.keys()):
+            for pkg in self.project_pkgs:
                 if pkg in local_pkgs:
                     # Skip local packages.
                     continue
@@ -167,117 +647,724 @@ class SYSTEM:
                 if not os.path.exists(pkg_dir):
                     # Nope, this pkg is not in that product dir.
                     continue
-                self.pat_base_pkgs[pkg] = [
-                    re.compile(pkg_dir + os.sep),
-                    re.compile(r"([^/]+)/(.*): " + prod_dir + \
-                    r"/([^/]+)/v[^/]+/include/(.*[.](?:h|hh|hpp|i|icc|tcc))$") ]
+                self.base_pkg_dirs[pkg] = prod_dir
+        self.pat_base_pkgs = None
+        if not self.base_pkg_dirs:
+            return
+        # Match every product dir at once and capture the pkg name
+        # that follows it, the pkg is then checked with a dictionary
+        # lookup instead of trying one pattern per base pkg.
+        prod_dirs = {}
+        for prod_dir in self.base_pkg_dirs.values():
+            prod_dirs[prod_dir] = 1
+        alts = [re.escape(x) for x in sorted(prod_dirs.keys())]
+        self.pat_base_pkgs = re.compile(r"([^/]+)/(.*): (" + \
+            "|".join(alts) + \
+            r")/([^/]+)/v[^/]+/include/(.*[.](?:h|hh|hpp|i|icc|tcc))$")
+
+    def match_base_pkg_line(self, line):
+        """Match a dependency line against the base pkgs, returning
+           a (dep, dep_file) tuple, or None if there is no match."""
+        if self.pat_base_pkgs is None:
+            return None
+        res = self.pat_base_pkgs.match(line)
+        if not res:
+            return None
+        if self.base_pkg_dirs.get(res.group(4)) != res.group(3):
+            # Not a base pkg, or not from the product dir we
+            # found the base pkg in.
+            return None
+        return (res.group(4), res.group(5))
+
+    def cache_signature(self):
+        """Return what the cached scan results depend on besides
+           the dependency files themselves."""
+        return (globals.mrb_source, globals.product_dirs,
+            sorted(self.base_pkg_dirs.items()))
+
+    def load_dependency_cache(self):
+        """Load the scan cache written by the previous run."""
+        self.file_cache = {}
+        if globals.opts.full_rescan:
+            return
+        if not os.path.exists(globals.dep_cache_file_name):
+            # No cache yet, not an error, we do a full scan.
+            return
+        try:
+            inf = open(globals.dep_cache_file_name, "rb")
+            try:
+                cache = pickle.load(inf)
+            finally:
+                inf.close()
+        except Exception:
+            print >>sys.stderr, "WARNING: ignoring unreadable cache", \
+                globals.dep_cache_file_name
+            return
+        if (not isinstance(cache, dict)) or \
+                (cache.get("version") != globals.dep_cache_version) or \
+                (cache.get("signature") != self.cache_signature()):
+            # Made by another mrb, or the local or base pkgs have
+            # changed since, the cached results may be wrong.
+            return
+        self.file_cache = cache["files"]
+
+    def write_dependency_cache(self):
+        """Write the scan cache for the next run.  Files which were
+           not seen by this run are dropped."""
+        cache = {
+            "version" : globals.dep_cache_version,
+            "signature" : self.cache_signature(),
+            "files" : self.new_file_cache }
+        tmp_name = "%s.%d" % (globals.dep_cache_file_name, os.getpid())
+        outf = open(tmp_name, "wb")
+        pickle.dump(cache, outf, pickle.HIGHEST_PROTOCOL)
+        outf.close()
+        os.rename(tmp_name, globals.dep_cache_file_name)
 
     def scan_local_dependencies(self):
         """Scan the mrb build directory for dependency info."""
-        curdir = os.getcwd()
-        os.chdir(globals.mrb_build)
-        for nm in sorted(os.listdir(".")):
-            if not os.path.isdir(nm):
+        pkgs = []
+        for (nm, is_dir) in list_dir(globals.mrb_build):
+            if not is_dir:
                 # Skip ordinary files.
                 continue;
             if nm == "CMakeFiles":
                 # Top level CMakeFiles dir is not interesting.
                 continue;
             # This is a package build directory.
-            self.handle_package_build_dir(nm)
-        os.chdir(curdir)
+            pkgs.append(nm)
+            self.local_deps[nm] = {}
+        globals.stats.count("pkg_build_dirs", len(pkgs))
+        if "make" in globals.opts.sources:
+            globals.stats.time_phase("scan make files",
+                self.scan_make_dependencies, pkgs)
+        if "depfile" in globals.opts.sources:
+            globals.stats.time_phase("scan depfiles",
+                self.scan_depfile_dependencies)
+        if "ninja" in globals.opts.sources:
+            globals.stats.time_phase("scan ninja deps log",
+                self.scan_ninja_dependencies)
+            for pkg in self.ninja_deps.keys():
+                merge_deps(self.local_deps[pkg], self.ninja_deps[pkg])
+
+    def scan_make_dependencies(self, pkgs):
+        """Scan the package build directories for make format
+           dependency files."""
+        jobs = min(globals.opts.jobs, len(pkgs))
+        if (jobs > 1) and (multiprocessing is None):
+            print >>sys.stderr, "WARNING: multiprocessing is not " + \
+                "available, scanning serially."
+            jobs = 1
+        if jobs > 1:
+            pool = multiprocessing.Pool(jobs, init_scan_worker, (self,))
+            try:
+                results = pool.map(scan_worker, pkgs, 1)
+            except:
+                pool.terminate()
+                pool.join()
+                raise
+            pool.close()
+            pool.join()
+        else:
+            results = [self.handle_package_build_dir(x) for x in pkgs]
+        # Note: Results come back in the order of pkgs, whichever
+        #       worker scanned them, so the merge is deterministic.
+        for i in range(len(pkgs)):
+            if jobs > 1:
+                # Workers count in their own process.
+                (results[i], counters) = results[i]
+                globals.stats.merge(counters)
+            (pkgdepends, file_cache) = results[i]
+            merge_deps(self.local_deps[pkgs[i]], pkgdepends)
+            self.new_file_cache.update(file_cache)
+
+    def build_dir_pkg(self, path):
+        """Return the package whose build directory contains path,
+           or None if it is not in a package build directory."""
+        if not path.startswith(globals.mrb_build + os.sep):
+            return None
+        pkg = path[len(globals.mrb_build) + 1:].split(os.sep)[0]
+        if not self.local_deps.has_key(pkg):
+            return None
+        return pkg
+
+    def scan_depfile_dependencies(self):
+        """Collect dependency info from the compiler dependency files
+           named in compile_commands.json."""
+        if not os.path.exists(globals.compile_commands_file_name):
+            print >>sys.stderr, "WARNING: No compile_commands.json in", \
+                globals.mrb_build
+            return
+        dir_pkgs = {}
+        for (directory, depfile) in \
+                read_compile_commands(globals.compile_commands_file_name):
+            if not dir_pkgs.has_key(directory):
+                dir_pkgs[directory] = self.build_dir_pkg(directory)
+            pkg = dir_pkgs[directory]
+            if pkg is None:
+                continue
+            self.depfile_pkgs[depfile] = pkg
+            if not os.path.exists(depfile):
+                # Not compiled yet, or consumed by ninja.
+                continue
+            self.handle_depend_file(depfile, 1, self.local_deps[pkg], \
+                self.new_file_cache)
+
+    def scan_ninja_dependencies(self):
+        """Collect dependency info from the ninja deps log.  If it
+           cannot be read the previous info is kept."""
+        # Note: The deps log changes with every build, so it is not
+        #       worth caching.
+        ninja_deps = {}
+        ninja_objects = None
+        if globals.opts.objects:
+            ninja_objects = {}
+        for (target, line) in read_ninja_deps(globals.mrb_build):
+            pkg = self.build_dir_pkg(os.path.join(globals.mrb_build, target))
+            if pkg is None:
+                continue
+            if not ninja_deps.has_key(pkg):
+                ninja_deps[pkg] = {}
+            globals.stats.count("ninja_lines_read")
+            self.record_dep_line(line, ninja_deps[pkg], ninja_objects)
+        self.ninja_deps = ninja_deps
+        self.ninja_objects = ninja_objects
 
     def handle_package_build_dir(self, pkg):
-        """Scan a package build directory for dependency info."""
+        """Scan a package build directory for dependency info,
+           returning the info and the scan cache entries for it."""
         #print >>sys.stderr, "DEBUG:", pkg
         pkgdepends = {}
-        os.chdir(pkg)
-        for nm in sorted(os.listdir(".")):
-            if not os.path.isdir(nm):
+        file_cache = {}
+        pkg_dir = os.path.join(globals.mrb_build, pkg)
+        for (nm, is_dir) in list_dir(pkg_dir):
+            if not is_dir:
                 # We are looking for cmake info dirs,
                 # skip ordinary files.
                 continue;
-            self.scan_dir_for_depends(nm, 1, pkgdepends)
-        self.local_deps[pkg] = pkgdepends
-        os.chdir("..")
+            self.scan_dir_for_depends(os.path.join(pkg_dir, nm), 1, \
+                pkgdepends, file_cache)
+        return (pkgdepends, file_cache)
 
-    def scan_dir_for_depends(self, dirname, level, pkgdepends):
+    def scan_dir_for_depends(self, dirname, level, pkgdepends, file_cache):
         """Recursively scan a directory for dependency files."""
         #indent = globals.indent * level
         #print >>sys.stderr, "DEBUG: %s%s" % (indent, dirname)
-        os.chdir(dirname)
-        for nm in sorted(os.listdir(".")):
-            if os.path.isdir(nm):
+        for (nm, is_dir) in list_dir(dirname):
+            path = os.path.join(dirname, nm)
+            if is_dir:
                 # Recursively scan subdirectories.
-                self.scan_dir_for_depends(nm, level + 1, pkgdepends)
-            if nm == "depend.make":
+                self.scan_dir_for_depends(path, level + 1, pkgdepends, \
+                    file_cache)
+            if nm in make_dep_file_names:
                 # Found a cmake dependency info file, scan it.
-                self.collect_deps_from_a_file(os.path.abspath(nm), \
-                    level + 1, pkgdepends)
-        os.chdir("..")
-        
-    def collect_deps_from_a_file(self, filename, level, pkgdepends):
+                self.handle_depend_file(path, level + 1, pkgdepends, \
+                    file_cache)
+
+    def handle_depend_file(self, filename, level, pkgdepends, file_cache):
+        """Collect dependency info from a dependency file, reusing the
+           cached info if the file is unchanged since the last scan."""
+        st = os.stat(filename)
+        globals.stats.count("stat_calls")
+        stamp = (st.st_mtime, st.st_size)
+        entry = self.file_cache.get(filename)
+        if entry and (entry[0] == stamp) and \
+                ((entry[2] is not None) or (not globals.opts.objects)):
+            globals.stats.count("dep_files_cached")
+            (file_deps, file_objects) = entry[1:]
+        else:
+            globals.stats.count("dep_files_read")
+            file_deps = {}
+            file_objects = None
+            if globals.opts.objects:
+                file_objects = {}
+            self.collect_deps_from_a_file(filename, level, file_deps, \
+                file_objects)
+        file_cache[filename] = (stamp, file_deps, file_objects)
+        merge_deps(pkgdepends, file_deps)
+
+    def collect_deps_from_a_file(self, filename, level, pkgdepends, \
+            objects=None):
         """Collect dependency info from a make format dependency file."""
         #indent = globals.indent * level
         #print >>sys.stderr, "DEBUG: %s%s" % (indent, filename)
-        inf = open(filename, "r")
-        for line in inf:
-            if "#" == line[0]:
-                # Skip comment lines.
-                continue
-            res = None
-            if globals.pat_mrb_source.search(line):
-                # Found a dependency on a local pkg.
-                # Get the package names out of the dependency line.
-                res = globals.pat_pkg_names.match(line)
-                #if res:
-                #    print >>sys.stderr, "DEBUG:", \
-                #        "res.group(1):", res.group(1), \
-                #        "res.group(2):", res.group(2), \
-                #        "res.group(3):", res.group(3), \
-                #        "res.group(4):", res.group(4)
-            else:
-                # Not a dependency on a local pkg, check for a base pkg.
-                found = False
-                for base_pkg in sorted(self.pat_base_pkgs.keys()):
-                    if self.pat_base_pkgs[base_pkg][0].search(line):
-                        # Found use of a file from a base pkg.
-                        res = self.pat_base_pkgs[base_pkg][1].match(line)
-                        #if res:
-                        #    print >>sys.stderr, \
-                        #        "DEBUG: base pkg:", \
-                        #        "res.group(1):", res.group(1), \
-                        #        "res.group(2):", res.group(2), \
-                        #        "res.group(3):", res.group(3), \
-                        #        "res.group(4):", res.group(4)
-                        found = True
-                        break
-                if not found:
-                    # Did not match a local pkg or a base pkg, skip it.
-                    continue
+        nlines = 0
+        for line in read_make_deps(filename):
+            nlines += 1
+            self.record_dep_line(line, pkgdepends, objects)
+        globals.stats.count("dep_lines_read", nlines)
+
+    def record_dep_line(self, line, pkgdepends, objects=None):
+        """Record the dependency info of a 'target: prerequisite' line,
+           if it is the use of a header from a local or base pkg.  If
+           objects is given, also record which target uses the header."""
+        if globals.pat_mrb_source.search(line):
+            # Found a dependency on a local pkg.
+            # Get the package names out of the dependency line.
+            res = globals.pat_pkg_names.match(line)
             if not res:
-                # Note: Match failures are expected.  We are only matching
-                #       header files, source files are excluded.
-                continue
-            # Got dependency info, now record it.
-            dep = res.group(3)
-            if not pkgdepends.has_key(dep):
-                pkgdepends[dep] = {}
-                pkgdepends[dep][res.group(4)] = 1
+                # Note: Match failures are expected.  We are only
+                #       matching header files, source files are
+                #       excluded.
+                return
+            #print >>sys.stderr, "DEBUG:", \
+            #    "res.group(1):", res.group(1), \
+            #    "res.group(2):", res.group(2), \
+            #    "res.group(3):", res.group(3), \
+            #    "res.group(4):", res.group(4)
+            (dep, dep_file) = (res.group(3), res.group(4))
+            if globals.stats.enabled:
+                globals.stats.count("local_header_lines")
+        else:
+            # Not a dependency on a local pkg, check for a base pkg.
+            res = self.match_base_pkg_line(line)
+            if globals.stats.enabled and (self.pat_base_pkgs is not None):
+                # One combined pattern is tried for all base pkgs.
+                globals.stats.count("base_pattern_attempts")
+                if res:
+                    globals.stats.count_key("base_pattern_hits", res[0])
+            if not res:
+                # Did not match a base pkg header, skip it.
+                return
+            #print >>sys.stderr, "DEBUG: base pkg:", res
+            (dep, dep_file) = res
+        # Got dependency info, now record it.
+        if not pkgdepends.has_key(dep):
+            pkgdepends[dep] = { dep_file : 1 }
+        else:
+            pkgdepends[dep][dep_file] = 1
+        if objects is not None:
+            # The target is everything before the last ': ', as
+            # for the patterns.
+            target = line[:line.rfind(": ")]
+            if not objects.has_key(dep):
+                objects[dep] = {}
+            if not objects[dep].has_key(dep_file):
+                objects[dep][dep_file] = { target : 1 }
             else:
-                if not pkgdepends[dep].has_key(res.group(4)):
-                    pkgdepends[dep][res.group(4)] = 1
-        inf.close()
+                objects[dep][dep_file][target] = 1
 
     def write_local_dependency_database(self):
         """Dump the combined project and local dependency database to disk
-           as the new local dependency database."""
-        outf = open(globals.dep_file_name, "w")
-        for pkg in sorted(self.deps.keys()):
-            for dep in sorted(self.deps[pkg].keys()):
-                for dep_file in sorted(self.deps[pkg][dep].keys()):
-                    print >>outf, "%s : %s : %s" % (pkg, dep, dep_file)
+           as the new local dependency database.  The sorted project
+           database is merged with the sorted local edges in one pass,
+           a local pkg replaces that pkg in the project database.  A
+           project database which is not sorted is loaded to sort it."""
+        local = depDatabase.DEPENDENCY_DATABASE()
+        for pkg in self.local_deps.keys():
+            local.replace_pkg(pkg, self.local_deps[pkg])
+        if not os.path.exists(globals.project_dep_file_name):
+            self.write_merged_database(local, [])
+            return
+        try:
+            self.write_merged_database(local,
+                depDatabase.iter_database_edges(globals.project_dep_file_name))
+        except depDatabase.UNSORTED_DATABASE, e:
+            print >>sys.stderr, "WARNING: %s, sorting it in memory" % e
+            base = depDatabase.DEPENDENCY_DATABASE()
+            base.load(globals.project_dep_file_name)
+            self.write_merged_database(local, base.edges())
+
+    def write_merged_database(self, local, base_edges):
+        """Write the local dependency database from the local edges and
+           the sorted project edges."""
+        streams = [local.edges(), (edge for edge in base_edges
+            if not self.local_deps.has_key(edge[0]))]
+        edges = depDatabase.merge_edges(streams)
+        if globals.stats.enabled:
+            edges = self.count_edges(edges)
+        if globals.opts.format == "compact":
+            depDatabase.write_compact_database(edges, globals.dep_file_name)
+        else:
+            depDatabase.write_text_database(edges, globals.dep_file_name)
+
+    def write_object_dependency_database(self):
+        """Write the object level database of the local pkgs.  It has
+           the same format as the pkg level database, with an edge
+           (dep, dep_file, target) for every target using a header, so
+           the targets using a header are the files of its edges."""
+        objects = depDatabase.DEPENDENCY_DATABASE()
+        file_objects = [x[2] for x in self.new_file_cache.values()]
+        file_objects.append(self.ninja_objects)
+        for deps in file_objects:
+            if deps is None:
+                continue
+            for dep in deps.keys():
+                for dep_file in deps[dep].keys():
+                    for target in deps[dep][dep_file].keys():
+                        objects.add_edge(dep, dep_file, target)
+        if globals.opts.format == "compact":
+            objects.write_compact(globals.object_dep_file_name)
+        else:
+            objects.write_text(globals.object_dep_file_name)
+
+    def count_edges(self, edges):
+        """Pass edges through, counting them."""
+        n = 0
+        for edge in edges:
+            n += 1
+            yield edge
+        globals.stats.count("edges_written", n)
+
+    def watch(self):
+        """Keep the local dependency database up to date as the build
+           writes dependency files, until interrupted.  Bursts of
+           changes are collected until the build area has been quiet
+           for a while, or for at most the update interval, then only
+           the changed files are scanned again.  If the build area
+           cannot be watched, it is scanned again every update
+           interval instead."""
+        # Every scanned file is in the scan cache now, so only files
+        # which really changed get parsed again.
+        self.file_cache = self.new_file_cache
+        notifier = INOTIFY()
+        if self.watch_tree(notifier, globals.mrb_build) is None:
+            notifier = None
+        # Stop cleanly on kill as well as on interrupt.
+        signal.signal(signal.SIGTERM, raise_interrupt)
+        print >>sys.stderr, "INFO: Watching", globals.mrb_build + \
+            ", interrupt to stop."
+        # Changed dependency files, and whether to rescan everything.
+        pending = {}
+        rescan = False
+        first_change = None
+        try:
+            while True:
+                if notifier is None:
+                    time.sleep(globals.opts.interval)
+                    globals.stats.time_phase("watch update",
+                        self.update_local_dependencies, [], True)
+                    continue
+                if pending or rescan:
+                    timeout = globals.opts.settle
+                else:
+                    timeout = None
+                events = notifier.read_events(timeout)
+                for (path, mask) in events:
+                    if path is None:
+                        # Events were lost.
+                        rescan = True
+                    elif mask & INOTIFY.IN_ISDIR:
+                        if mask & (INOTIFY.IN_CREATE | INOTIFY.IN_MOVED_TO):
+                            if os.path.dirname(path) == globals.mrb_build:
+                                # Possibly a new package build dir.
+                                rescan = True
+                            # Files may have been written before the
+                            # directory was watched.
+                            files = self.watch_tree(notifier, path)
+                            if files is None:
+                                notifier = None
+                                rescan = True
+                                break
+                            for filename in files:
+                                if self.is_dependency_file(filename):
+                                    pending[filename] = 1
+                    elif path == globals.compile_commands_file_name:
+                        if "depfile" in globals.opts.sources:
+                            rescan = True
+                    elif self.is_dependency_file(path):
+                        pending[path] = 1
+                if not (pending or rescan):
+                    continue
+                now = time.time()
+                if first_change is None:
+                    first_change = now
+                if events and (notifier is not None) and \
+                        (now - first_change < globals.opts.interval):
+                    continue
+                globals.stats.time_phase("watch update",
+                    self.update_local_dependencies, pending.keys(), rescan)
+                pending = {}
+                rescan = False
+                first_change = None
+        except KeyboardInterrupt:
+            if pending or rescan:
+                self.update_local_dependencies(pending.keys(), rescan)
+        if notifier is not None:
+            notifier.close()
+
+    def watch_tree(self, notifier, top):
+        """Watch the directory tree top with notifier, returning the
+           files found in it.  If there are not enough inotify watches
+           left, close notifier and return None."""
+        try:
+            return notifier.add_tree(top)
+        except OSError, e:
+            if e.errno != errno.ENOSPC:
+                raise
+        notifier.close()
+        print >>sys.stderr, "WARNING: Out of inotify watches, raise the " \
+            "fs.inotify.max_user_watches sysctl to watch", globals.mrb_build
+        print >>sys.stderr, "         Scanning it every %g seconds " \
+            "instead." % globals.opts.interval
+        return None
+
+    def is_dependency_file(self, path):
+        """Check if path is a dependency file of a selected source."""
+        if "make" in globals.opts.sources:
+            if os.path.basename(path) in make_dep_file_names:
+                return True
+        if "depfile" in globals.opts.sources:
+            if self.depfile_pkgs.has_key(path):
+                return True
+        if "ninja" in globals.opts.sources:
+            if path == globals.ninja_deps_file_name:
+                return True
+        return False
+
+    def dependency_file_pkg(self, path):
+        """Return the pkg a dependency file belongs to, or None."""
+        pkg = self.depfile_pkgs.get(path)
+        if pkg is None:
+            pkg = self.build_dir_pkg(path)
+        return pkg
+
+    def update_local_dependencies(self, paths, rescan):
+        """Scan the changed dependency files, or everything if rescan
+           is set, and write the database if the info has changed."""
+        old_deps = self.local_deps
+        if rescan:
+            old_file_cache = self.new_file_cache
+            old_depfile_pkgs = self.depfile_pkgs
+            self.local_deps = {}
+            self.new_file_cache = {}
+            self.depfile_pkgs = {}
+            try:
+                self.scan_local_dependencies()
+            except NINJA_DEPS_ERROR, e:
+                print >>sys.stderr, "ERROR: %s, keeping the previous " \
+                    "dependencies" % e
+                self.local_deps = old_deps
+                self.new_file_cache = old_file_cache
+                self.depfile_pkgs = old_depfile_pkgs
+                return
+            self.file_cache = self.new_file_cache
+        else:
+            self.local_deps = old_deps.copy()
+            changed_pkgs = {}
+            for path in paths:
+                if path == globals.ninja_deps_file_name:
+                    old_ninja_pkgs = self.ninja_deps.keys()
+                    try:
+                        self.scan_ninja_dependencies()
+                    except NINJA_DEPS_ERROR, e:
+                        print >>sys.stderr, "ERROR: %s, keeping the " \
+                            "previous ninja dependencies" % e
+                        continue
+                    for pkg in old_ninja_pkgs + self.ninja_deps.keys():
+                        changed_pkgs[pkg] = 1
+                    continue
+                pkg = self.dependency_file_pkg(path)
+                if pkg is None:
+                    continue
+                changed_pkgs[pkg] = 1
+                try:
+                    self.handle_depend_file(path, 1, {}, self.new_file_cache)
+                except (IOError, OSError):
+                    # Removed, or removed while we read it.
+                    if self.new_file_cache.has_key(path):
+                        del self.new_file_cache[path]
+            for pkg in changed_pkgs.keys():
+                self.rebuild_pkg_dependencies(pkg)
+        if (self.local_deps == old_deps) and (not globals.opts.objects):
+            # Nothing which matters has changed.
+            return
+        self.write_local_dependency_database()
+        self.write_dependency_cache()
+        if globals.opts.objects:
+            self.write_object_dependency_database()
+        if globals.opts.graph_file:
+            self.emit_package_graph()
+        print >>sys.stderr, "INFO: Updated", globals.dep_file_name, \
+            time.strftime("%H:%M:%S")
+
+    def rebuild_pkg_dependencies(self, pkg):
+        """Combine the scanned info of all the dependency files of pkg."""
+        pkgdepends = {}
+        for (filename, entry) in self.new_file_cache.items():
+            if self.dependency_file_pkg(filename) == pkg:
+                merge_deps(pkgdepends, entry[1])
+        merge_deps(pkgdepends, self.ninja_deps.get(pkg, {}))
+        self.local_deps[pkg] = pkgdepends
+
+    def package_graph(self):
+        """Return the graph of the local pkgs in the build area.
+
+        A pkg uses the local pkgs whose headers it includes.  Its
+        weight, an estimate of its build time, is the number of
+        dependency files scanned for it, which is about the number of
+        its targets (make) or objects (depfile).  Pkgs which use each
+        other are built as one, so levels and paths are computed on
+        the strongly connected components:
+
+        level:           0 for pkgs which use no other local pkg,
+                         otherwise one more than the highest level
+                         of the pkgs it uses.
+        earliest_finish: the weights along the heaviest chain of
+                         pkgs it uses, including its own.
+        priority:        the weights along the heaviest chain of
+                         pkgs using it, including its own, build
+                         the pkgs with the highest priority first.
+        """
+        pkgs = sorted(self.local_deps.keys())
+        uses = {}
+        headers = {}
+        for pkg in pkgs:
+            pkg_uses = []
+            for dep in sorted(self.local_deps[pkg].keys()):
+                if (dep != pkg) and self.local_deps.has_key(dep):
+                    pkg_uses.append(dep)
+                    headers[(pkg, dep)] = len(self.local_deps[pkg][dep])
+            uses[pkg] = pkg_uses
+        weight = dict.fromkeys(pkgs, 0)
+        for filename in self.new_file_cache.keys():
+            pkg = self.dependency_file_pkg(filename)
+            if weight.has_key(pkg):
+                weight[pkg] += 1
+        for pkg in pkgs:
+            weight[pkg] = max(weight[pkg], 1)
+        comps = strongly_connected_components(pkgs, uses)
+        comp_of = {}
+        for i in range(len(comps)):
+            for pkg in comps[i]:
+                comp_of[pkg] = i
+        # Components used by and using each component.
+        comp_uses = [{} for x in comps]
+        comp_users = [{} for x in comps]
+        for pkg in pkgs:
+            for dep in uses[pkg]:
+                if comp_of[dep] != comp_of[pkg]:
+                    comp_uses[comp_of[pkg]][comp_of[dep]] = 1
+                    comp_users[comp_of[dep]][comp_of[pkg]] = 1
+        comp_weight = [sum([weight[x] for x in comp]) for comp in comps]
+        # The components come after the ones they use.
+        level = [0] * len(comps)
+        finish = [0] * len(comps)
+        longest_dep = [None] * len(comps)
+        for i in range(len(comps)):
+            for j in comp_uses[i].keys():
+                level[i] = max(level[i], level[j] + 1)
+                # Ties go to the first component by name.
+                k = longest_dep[i]
+                if (k is None) or \
+                        ((-finish[j], comps[j]) < (-finish[k], comps[k])):
+                    longest_dep[i] = j
+            finish[i] = comp_weight[i]
+            if longest_dep[i] is not None:
+                finish[i] += finish[longest_dep[i]]
+        priority = [0] * len(comps)
+        for i in range(len(comps) - 1, -1, -1):
+            priority[i] = comp_weight[i] + \
+                max([0] + [priority[j] for j in comp_users[i].keys()])
+        critical_path = []
+        if comps:
+            i = 0
+            for j in range(len(comps)):
+                if (-finish[j], comps[j]) < (-finish[i], comps[i]):
+                    i = j
+            length = finish[i]
+            while i is not None:
+                critical_path[:0] = comps[i]
+                i = longest_dep[i]
+        else:
+            length = 0
+        levels = [[] for x in range(max([-1] + level) + 1)]
+        for pkg in pkgs:
+            levels[level[comp_of[pkg]]].append(pkg)
+        for pkgs_at_level in levels:
+            # Longest first.
+            pkgs_at_level.sort(lambda a, b:
+                cmp(priority[comp_of[b]], priority[comp_of[a]]) or cmp(a, b))
+        packages = {}
+        for pkg in pkgs:
+            i = comp_of[pkg]
+            packages[pkg] = {
+                "uses" : uses[pkg],
+                "headers_used" : [headers[(pkg, x)] for x in uses[pkg]],
+                "weight" : weight[pkg],
+                "level" : level[i],
+                "earliest_finish" : finish[i],
+                "priority" : priority[i] }
+        return {
+            "packages" : packages,
+            "levels" : levels,
+            "critical_path" : { "length" : length,
+                "packages" : critical_path },
+            "cycles" : [x for x in comps if len(x) > 1] }
+
+    def emit_package_graph(self):
+        """Write the graph of the local pkgs to the --emit-graph file."""
+        graph = self.package_graph()
+        tmp_name = "%s.%d" % (globals.opts.graph_file, os.getpid())
+        outf = open(tmp_name, "w")
+        if globals.opts.graph_format == "json":
+            json.dump(graph, outf, indent=2, sort_keys=True)
+            outf.write("\n")
+        else:
+            self.write_dot_graph(graph, outf)
         outf.close()
+        os.rename(tmp_name, globals.opts.graph_file)
+        for cycle in graph["cycles"]:
+            print >>sys.stderr, "WARNING: Dependency cycle between " + \
+                "packages:", " ".join(cycle)
+
+    def write_dot_graph(self, graph, outf):
+        """Write graph in DOT format, an edge points from a pkg to
+           a pkg it uses."""
+        packages = graph["packages"]
+        critical = dict.fromkeys(graph["critical_path"]["packages"], 1)
+        in_cycle = {}
+        for cycle in graph["cycles"]:
+            for pkg in cycle:
+                in_cycle[pkg] = 1
+        print >>outf, "digraph packages {"
+        print >>outf, "  rankdir=BT;"
+        print >>outf, "  node [shape=box];"
+        for pkgs_at_level in graph["levels"]:
+            print >>outf, "  { rank=same;"
+            for pkg in pkgs_at_level:
+                attrs = ['label="%s\\nweight %d, priority %d"' % \
+                    (pkg, packages[pkg]["weight"], packages[pkg]["priority"])]
+                if critical.has_key(pkg):
+                    attrs.append("color=red")
+                if in_cycle.has_key(pkg):
+                    attrs.append("style=filled")
+                    attrs.append("fillcolor=orange")
+                print >>outf, "    %s [%s];" % (dot_quote(pkg),
+                    ", ".join(attrs))
+            print >>outf, "  }"
+        path = graph["critical_path"]["packages"]
+        critical_edges = {}
+        for i in range(1, len(path)):
+            critical_edges[(path[i], path[i - 1])] = 1
+        for pkg in sorted(packages.keys()):
+            for i in range(len(packages[pkg]["uses"])):
+                dep = packages[pkg]["uses"][i]
+                attrs = ['label="%d"' % packages[pkg]["headers_used"][i]]
+                if critical_edges.has_key((pkg, dep)):
+                    attrs.append("color=red")
+                print >>outf, "  %s -> %s [%s];" % (dot_quote(pkg),
+                    dot_quote(dep), ", ".join(attrs))
+        print >>outf, "}"
+
+def raise_interrupt(signum, frame):
+    """Signal handler, stop like on an interrupt."""
+    raise KeyboardInterrupt
+
+# Scanner used by the process pool workers.
+worker_system = None
+
+def init_scan_worker(system):
+    """Process pool initializer, remember the scanner."""
+    global worker_system
+    worker_system = system
+
+def scan_worker(pkg):
+    """Process pool entry point, scan one package build dir.  The
+       counters of the scan go back with its results."""
+    globals.stats.counters = {}
+    return (worker_system.handle_package_build_dir(pkg),
+        globals.stats.counters)
 
 if __name__ == "__main__":
     # We are being run as a script.
@@ -180,19 +180,19 @@ function make_localProducts_directory()
     fi
     if [ ! -z ${prjdir} ] && [ -d ${prjdir} ]
     then
-        $MRB_DIR/libexec/copy_dependency_database.sh ${MRB_SOURCE} ${MRB_INSTALL} ${MRB_PROJECTUC}_DIR
+        $MRB_DIR/libexec/copy_dependency_database.sh ${MRB_SOURCE} ${MRB_INSTALL} ${MRB_PROJECTUC}_DIR ${MRB_PROJECT_VERSION}
     elif [ ! -z ${prjcodedir} ] && [ -d ${prjcodedir} ] 
     then
-       $MRB_DIR/libexec/copy_dependency_database.sh ${MRB_SOURCE} ${MRB_INSTALL} ${MRB_PROJECTUC}CODE_DIR
+       $MRB_DIR/libexec/copy_dependency_database.sh ${MRB_SOURCE} ${MRB_INSTALL} ${MRB_PROJECTUC}CODE_DIR ${MRB_PROJECT_VERSION}
     else      
         ##echo "look for ${MRB_PROJECT} ${MRB_PROJECT_VERSION}"
 	if ups exist ${MRB_PROJECT} ${MRB_PROJECT_VERSION} -q ${MRB_QUALS} >/dev/null 2>&1; then
             source `${UPS_DIR}/bin/ups setup -j ${MRB_PROJECT} ${MRB_PROJECT_VERSION} -q ${MRB_QUALS}`
-            $MRB_DIR/libexec/copy_dependency_database.sh ${MRB_SOURCE} ${MRB_INSTALL} ${MRB_PROJECTUC}_DIR
+            $MRB_DIR/libexec/copy_dependency_database.sh ${MRB_SOURCE} ${MRB_INSTALL} ${MRB_PROJECTUC}_DIR ${MRB_PROJECT_VERSION}
 	    unsetup -j ${MRB_PROJECT}
 	elif ups exist ${MRB_PROJECT}code ${MRB_PROJECT_VERSION} -q ${MRB_QUALS} >/dev/null 2>&1; then
             source `${UPS_DIR}/bin/ups setup -j ${MRB_PROJECT}code ${MRB_PROJECT_VERSION} -q ${MRB_QUALS}`
-            $MRB_DIR/libexec/copy_dependency_database.sh ${MRB_SOURCE} ${MRB_INSTALL} ${MRB_PROJECTUC}CODE_DIR
+            $MRB_DIR/libexec/copy_dependency_database.sh ${MRB_SOURCE} ${MRB_INSTALL} ${MRB_PROJECTUC}CODE_DIR ${MRB_PROJECT_VERSION}
 	    unsetup -j ${MRB_PROJECT}
 	else
             echo "INFO: cannot find ${MRB_PROJECT}/${MRB_PROJECT_VERSION}/releaseDB/base_dependency_database"
@@ -299,10 +299,10 @@ function check_qualList() {
 }
 
 # Return success if any specified directory is not empty (ignoring MRB
-# lock directories).
+# lock directories and files).
 function dir_is_dirty()
 {
-  ls -1AF "$@" | grep -qvEe '^\.locks/$'
+  ls -1AF "$@" | grep -qvEe '^\.(locks/|add_to_cmake\.lock)$'
 }
 
 # Set up configuration
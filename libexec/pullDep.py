@@ -3,12 +3,18 @@
 
 """Consruct a dependency database."""
 
+import depDatabase
+import depServer
+import depStats
+import heapq
 import optparse
 import os
+import Queue
 import re
 import string
 import subprocess
 import sys
+import threading
 
 # Force the python version to be at least 2.4.x, which is
 # the version available in SLF5.x distributions (actually
@@ -44,6 +50,11 @@ class GLOBALS:
             ".base_dependency_database")
         self.dep_file_name = os.path.join(self.mrb_build, \
             ".dependency_database")
+        self.object_dep_file_name = self.dep_file_name + ".objects"
+        self.server_socket_name = depServer.socket_name(self.mrb_top)
+        self.git_checkout = os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), "gitCheckout")
+        self.stats = depStats.STATS("pullDep.py")
         #print >>sys.stderr, "DEBUG: opts:", self.opts
         #print >>sys.stderr, "DEBUG: args:", self.args
         #print >>sys.stderr, "DEBUG: MRB_SOURCE:", self.mrb_source
@@ -61,12 +72,44 @@ class GLOBALS:
                 "working area.  Normal behavior is to checkout any such " + \
                 "package if it has not already been checked out, but " + \
                 "this behavior can be prevented with the -n option."
-        p = optparse.OptionParser(description=descrip)
-        p.set_defaults(do_autocheckout=True)
+        usage="%prog [options]\n       %prog --rebuild-set <header> ..."
+        p = optparse.OptionParser(usage=usage, description=descrip)
+        p.set_defaults(do_autocheckout=True, detect="stat", build_order=False,
+            jobs=1, rebuild_set=False, use_server=True)
         p.add_option("-n", dest="do_autocheckout", action="store_false",
             help="no autocheckout")
-        (self.opts, self.args) = p.parse_args()
+        p.add_option("--detect", dest="detect", type="choice",
+            choices=["stat", "git"], metavar="METHOD",
+            help="how to find modified files, stat compares the " + \
+            "modification time of a file with that of its package " + \
+            "directory, git asks each package repository once for " + \
+            "its changed, untracked and locally committed files " + \
+            "(packages which are not git repositories fall back to " + \
+            "stat) [%default]")
+        p.add_option("--build-order", dest="build_order",
+            action="store_true",
+            help="checkout the affected packages in build order, a " + \
+            "package after the affected packages it uses")
+        p.add_option("-j", dest="jobs", type="int", metavar="N",
+            help="run up to N checkouts at the same time [%default]")
+        p.add_option("--rebuild-set", dest="rebuild_set", action="store_true",
+            help="instead of checking, print the objects and cmake " + \
+            "targets in the build area which use the given headers of " + \
+            "local pkgs, from the database written by " + \
+            "makeDeps --objects")
+        p.add_option("--no-server", dest="use_server",
+            action="store_false",
+            help="read the databases even if mrb depServer is running")
+        depStats.add_options(p)
+        (self.opts, self.args) = \
+            p.parse_args(depStats.command_line(sys.argv[1:]))
         #print >>sys.stderr, "DEBUG: do_autocheckout:", self.opts.do_autocheckout
+        if self.opts.jobs < 1:
+            p.error("-j must be at least 1")
+        if self.opts.rebuild_set != bool(self.args):
+            p.error("headers are given with --rebuild-set, and only then")
+        depStats.check_options(p, self.opts)
+        self.stats.start(self.opts)
 
 # Create an object to contain global variables.
 globals = GLOBALS()
@@ -79,115 +122,219 @@ class SYSTEM:
         #print >>sys.stderr, "DEBUG: System initializing."
         # Checked out pkgs in the local developer area.
         self.local_pkgs = {}
-        # Project dependency database.
-        self.project_deps = {}
-        # Local package information.
-        self.local_pkgs = {}
-        # Patterns for matching base pkgs.
-        self.pat_base_pkgs = []
-        # Local dependency database.
-        self.local_deps = {}
-        # Combined project and local dependency database.
-        self.deps = {}
+        # Combined project and local dependency database, the edges
+        # into the checked out pkgs only.
+        self.deps = depDatabase.DEPENDENCY_DATABASE()
         # Cache of modified files in local pkgs.
         self.file_mod_cache = {}
+        # Modified files reported by git, { pkg : { filename : 1 } }.
+        self.git_modified = {}
         # Packages we have tried to checkout at least once.
         self.notified_pkgs = {}
+        # Packages to checkout, in order.
+        self.checkouts = []
+        # Serializes the output of concurrent checkouts.
+        self.output_lock = threading.Lock()
 
     def run(self):
         """Entry Point."""
         #print >>sys.stderr, "DEBUG: System running."
         globals.parse_options()
-        self.load_project_dependency_database()
-        self.load_local_dependency_database()
-        self.deps = self.project_deps
-        self.deps.update(self.local_deps)
-        #print >>sys.stderr, "DEBUG: deps:", self.deps
-        self.get_list_of_local_pkgs()
-        #print >>sys.stderr, "DEBUG: local_pkgs:", self.local_pkgs
-        for pkg in sorted(self.deps.keys()):
-            if self.local_pkgs.has_key(pkg):
-                # Skip already checked out pkgs.
-                continue
-            for dep in sorted(self.deps[pkg]):
+        stats = globals.stats
+        if globals.opts.rebuild_set:
+            try:
+                stats.time_phase("rebuild set", self.print_rebuild_set)
+            finally:
+                stats.finish()
+            return
+        try:
+            stats.time_phase("list local packages",
+                self.get_list_of_local_pkgs)
+            #print >>sys.stderr, "DEBUG: local_pkgs:", self.local_pkgs
+            self.deps = self.load_dependencies(self.local_pkgs)
+            pairs = stats.time_phase("find consumers",
+                self.find_consumer_pairs)
+            stats.count("consumer_pairs", len(pairs))
+            if globals.opts.detect == "git":
+                deps = {}
+                for (pkg, dep) in pairs:
+                    deps[dep] = 1
+                stats.time_phase("ask git for modified files",
+                    self.find_git_modified_files, sorted(deps.keys()))
+            if globals.opts.build_order:
+                stats.time_phase("modification checks",
+                    self.handle_ordered_checkouts, pairs)
+            else:
+                stats.time_phase("modification checks",
+                    self.handle_direct_checkouts, pairs)
+            stats.count("checkouts_queued", len(self.checkouts))
+            stats.time_phase("checkouts", self.run_checkouts)
+        finally:
+            stats.finish()
+
+    def source_header(self, filename):
+        """Return the (pkg, dep_file) of a header in MRB_SOURCE, given
+           by its path or by its path relative to MRB_SOURCE."""
+        path = os.path.abspath(filename)
+        if not os.path.exists(path):
+            path = os.path.join(globals.mrb_source, filename)
+        path = os.path.normpath(path)
+        prefix = os.path.normpath(globals.mrb_source) + os.sep
+        if (not path.startswith(prefix)) or \
+                (os.sep not in path[len(prefix):]):
+            print >>sys.stderr, "ERROR: %s is not a file of a package " \
+                "in %s" % (filename, globals.mrb_source)
+            sys.exit(1)
+        return tuple(path[len(prefix):].split(os.sep, 1))
+
+    def print_rebuild_set(self):
+        """Print the cmake targets and objects which use the headers
+           given on the command line, 'target <dir> <name>' and
+           'object <path>' lines, paths relative to MRB_BUILDDIR."""
+        if not os.path.exists(globals.object_dep_file_name):
+            print >>sys.stderr, "ERROR: No object level dependency " + \
+                "database, run mrb makeDeps --objects first."
+            sys.exit(1)
+        headers = [self.source_header(x) for x in globals.args]
+        found = {}
+        lines = None
+        if globals.opts.use_server:
+            fields = ["used_by", globals.object_dep_file_name]
+            for header in headers:
+                fields.extend(header)
+            lines = depServer.query(globals.server_socket_name, fields)
+        if lines is not None:
+            for line in lines:
+                found[line.rstrip("\n")] = 1
+        else:
+            # The object database has (pkg, dep_file, target) edges,
+            # load only those of the dep_files we need.
+            objects = depDatabase.DEPENDENCY_DATABASE()
+            objects.load(globals.object_dep_file_name,
+                dict.fromkeys([x[1] for x in headers], 1))
+            for (pkg, dep_file) in headers:
+                for target in objects.headers_used(pkg, dep_file):
+                    found[target] = 1
+        globals.stats.count("headers", len(headers))
+        globals.stats.count("objects", len(found))
+        targets = {}
+        for target in found.keys():
+            # Objects are <dir>/CMakeFiles/<name>.dir/<source>.o, other
+            # targets stand for themselves.
+            parts = target.split("/CMakeFiles/", 1)
+            if (len(parts) == 2) and (".dir/" in parts[1]):
+                targets[(parts[0], parts[1].split(".dir/", 1)[0])] = 1
+        for (dir, name) in sorted(targets.keys()):
+            print "target", dir, name
+        for target in sorted(found.keys()):
+            print "object", target
+
+    def find_consumer_pairs(self):
+        """Return the sorted (pkg, dep) pairs of a checked out dep and
+           a pkg which uses it.  Only the consumers of checked out
+           pkgs can use a modified file."""
+        pairs = []
+        for dep in self.local_pkgs.keys():
+            for pkg in self.deps.consumer_pkgs(dep):
+                if self.local_pkgs.has_key(pkg):
+                    # Skip already checked out pkgs.
+                    continue
                 if dep == pkg:
                     # Ignore self-dependencies.
                     continue
-                if self.local_pkgs.has_key(dep):
-                    # We have a not-checked out pkg that depends
-                    # on a checked out pkg, check to see if we
-                    # should check it out.
-                    self.test_pkg_for_auto_checkout(pkg, dep)
+                pairs.append((pkg, dep))
+        pairs.sort()
+        return pairs
+
+    def handle_direct_checkouts(self, pairs):
+        """Check out the pkgs which use a modified file."""
+        for (pkg, dep) in pairs:
+            # We have a not-checked out pkg that depends
+            # on a checked out pkg, check to see if we
+            # should check it out.
+            self.test_pkg_for_auto_checkout(pkg, dep)
 
-    def load_project_dependency_database(self):
-        """Read in the project-level dependency database."""
-        self.deps = {}
+    def load_dependencies(self, wanted):
+        """Return the combined project and local dependency database
+           with the edges into the wanted pkgs, from mrb depServer if
+           it is running, otherwise from the files."""
+        stats = globals.stats
+        deps = depDatabase.DEPENDENCY_DATABASE()
+        if not stats.time_phase("ask dependency server",
+                self.query_dependency_server, deps, wanted):
+            stats.time_phase("load base database",
+                self.load_project_dependency_database, deps, wanted)
+            stats.time_phase("load local database",
+                self.load_local_dependency_database, deps, wanted)
+        return deps
+
+    def query_dependency_server(self, deps, wanted):
+        """Get the edges into the wanted pkgs of the combined databases
+           from mrb depServer into deps.  Return False if no server is
+           running, then we read them ourselves."""
+        if not globals.opts.use_server:
+            return False
+        if not wanted:
+            # Nothing to ask for.
+            return True
+        fields = ["consumers", globals.project_dep_file_name,
+            globals.dep_file_name] + sorted(wanted.keys())
+        lines = depServer.query(globals.server_socket_name, fields)
+        if lines is None:
+            return False
+        for line in lines:
+            (pkg, dep, dep_file) = line.split(":")
+            deps.add_edge(pkg.strip(), dep.strip(), dep_file.strip())
+        globals.stats.count("server_edges", len(lines))
+        return True
+
+    def load_project_dependency_database(self, deps, wanted):
+        """Read in the consumers of the wanted pkgs from the
+           project-level dependency database into deps."""
         if not os.path.exists(globals.project_dep_file_name):
             return
-        inf = open(globals.project_dep_file_name, "r")
-        for line in inf:
-            #print >>sys.stderr, "DEBUG:", line,
-            (pkg, dep, dep_file) = line.split(":")
-            pkg = pkg.strip()
-            dep = dep.strip()
-            dep_file = dep_file.strip()
-            #print >>sys.stderr, "DEBUG: '%s' : '%s' : '%s'" % (pkg, dep, dep_file)
-            if not self.project_deps.has_key(pkg):
-                self.project_deps[pkg] = { dep : { dep_file : 1 } }
-            else:
-                if not self.project_deps[pkg].has_key(dep):
-                    self.project_deps[pkg][dep] = { dep_file : 1 }
-                else:
-                    self.project_deps[pkg][dep][dep_file] = 1
-        inf.close()
+        deps.load(globals.project_dep_file_name, wanted)
 
-    def load_local_dependency_database(self):
-        """Read in development area dependency datatbase."""
+    def load_local_dependency_database(self, deps, wanted):
+        """Read in the consumers of the wanted pkgs from the
+           development area dependency database into deps, a pkg in
+           it replaces that pkg in the project database."""
         if not os.path.exists(globals.dep_file_name):
             # No dependency database to load, not an error.
             return
-        inf = open(globals.dep_file_name, "r")
-        for line in inf:
-            #print >>sys.stderr, "DEBUG:", line,
-            (pkg, dep, dep_file) = line.split(":")
-            pkg = pkg.strip()
-            dep = dep.strip()
-            dep_file = dep_file.strip()
-            #print >>sys.stderr, "DEBUG: '%s' : '%s' : '%s'" % (pkg, dep, dep_file)
-            if not self.local_deps.has_key(pkg):
-                self.local_deps[pkg] = { dep : { dep_file : 1 } }
-            else:
-                if not self.local_deps[pkg].has_key(dep):
-                    self.local_deps[pkg][dep] = { dep_file : 1 }
-                else:
-                    self.local_deps[pkg][dep][dep_file] = 1
-        inf.close()
+        local_deps = depDatabase.DEPENDENCY_DATABASE()
+        local_deps.load(globals.dep_file_name, wanted)
+        deps.merge(local_deps)
 
     def get_list_of_local_pkgs(self):
         """Make a list of local pkgs."""
-        curdir = os.getcwd()
-        os.chdir(globals.mrb_source)
-        tmp = os.listdir(".")
+        tmp = os.listdir(globals.mrb_source)
         tmp.sort()
         for nm in tmp:
-            if not os.path.isdir(nm):
+            if not os.path.isdir(os.path.join(globals.mrb_source, nm)):
                 # Skip ordinary files.
                 continue;
+            if nm.startswith("."):
+                # Skip .locks and the like.
+                continue
             # This is a package source directory.
             self.local_pkgs[nm] = 1
-        os.chdir(curdir)
 
     def test_pkg_for_auto_checkout(self, pkg, other_end):
         """Check pkg to see if it depends on a modified
            file in pkg other_end, and if so, check it out."""
         #print >>sys.stderr, "DEBUG: test_pkg_for_auto_checkout: Package:", \
         #    pkg, "Other End:", other_end
-        if not self.deps[pkg].has_key(other_end):
-            # This pkg has no dependencies on the other end,
-            # so we do not need to check it out.
-            return
-        needs_checkout = False
-        for dep_file in sorted(self.deps[pkg][other_end].keys()):
+        dep_file = self.find_modified_dep_file(pkg, other_end)
+        if dep_file is not None:
+            self.handle_auto_checkout(pkg, other_end, dep_file)
+
+    def find_modified_dep_file(self, pkg, other_end):
+        """Return the first modified file in pkg other_end which
+           pkg depends on, or None if there is none."""
+        # Empty if this pkg has no dependencies on the other end.
+        for dep_file in self.deps.headers_used(pkg, other_end):
+            globals.stats.count("headers_considered")
             if not self.file_mod_cache.has_key(other_end):
                 self.file_mod_cache[other_end] = {
                     dep_file :
@@ -196,26 +343,136 @@ class SYSTEM:
                 self.file_mod_cache[other_end][dep_file] = \
                     self.check_if_file_modified(other_end, dep_file)
             if self.file_mod_cache[other_end][dep_file]:
-                needs_checkout = True
-                break
-        if needs_checkout:
+                return dep_file
+        return None
+
+    def handle_ordered_checkouts(self, pairs):
+        """Check out the pkgs which use a modified file in build order.
+           The database has file level edges taken from the dependency
+           files of a build, which list every header a compile reads,
+           so a pkg which includes a modified file through the headers
+           of other pkgs has an edge to that file itself."""
+        # Why each affected pkg is affected, (other_end, dep_file).
+        reasons = {}
+        for (pkg, dep) in pairs:
+            if reasons.has_key(pkg):
+                continue
+            dep_file = self.find_modified_dep_file(pkg, dep)
+            if dep_file is not None:
+                reasons[pkg] = (dep, dep_file)
+        # The build order needs only the edges into the affected pkgs.
+        order_deps = self.load_dependencies(reasons)
+        for pkg in self.build_order(order_deps, sorted(reasons.keys())):
+            (other_end, dep_file) = reasons[pkg]
             self.handle_auto_checkout(pkg, other_end, dep_file)
 
+    def build_order(self, deps, pkgs):
+        """Return pkgs sorted so that every pkg comes after the pkgs
+           it uses in database deps.  Pkgs in dependency cycles are
+           added at the end."""
+        wanted = dict.fromkeys(pkgs, 1)
+        # Number of wanted pkgs each wanted pkg uses.
+        uses = dict.fromkeys(pkgs, 0)
+        for dep in pkgs:
+            for pkg in deps.consumer_pkgs(dep):
+                if (pkg != dep) and wanted.has_key(pkg):
+                    uses[pkg] += 1
+        ready = [x for x in pkgs if uses[x] == 0]
+        heapq.heapify(ready)
+        order = []
+        while ready:
+            dep = heapq.heappop(ready)
+            order.append(dep)
+            for pkg in deps.consumer_pkgs(dep):
+                if (pkg != dep) and wanted.has_key(pkg):
+                    uses[pkg] -= 1
+                    if uses[pkg] == 0:
+                        heapq.heappush(ready, pkg)
+        if len(order) < len(pkgs):
+            cycle = sorted([x for x in pkgs if uses[x] > 0])
+            print >>sys.stderr, "WARNING: Dependency cycle between " + \
+                "packages", " ".join(cycle)
+            order.extend(cycle)
+        return order
+
+    def find_git_modified_files(self, pkgs):
+        """Ask the git repository of each pkg for its changed and
+           untracked files, and for the files changed by commits not
+           yet in its upstream branch.  The git commands for all the
+           pkgs run at the same time."""
+        procs = []
+        for pkg in pkgs:
+            pkg_dir = os.path.join(globals.mrb_source, pkg)
+            if not os.path.exists(os.path.join(pkg_dir, ".git")):
+                # Not a git repository, use stat for this pkg.
+                continue
+            for cmd in [
+                    ["git", "status", "--porcelain", "-z",
+                        "--untracked-files=all"],
+                    ["git", "diff", "--name-only", "-z",
+                        "@{upstream}...HEAD"] ]:
+                proc = subprocess.Popen(cmd, cwd=pkg_dir, \
+                    stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                procs.append((pkg, cmd[1], proc))
+                globals.stats.count("git_commands")
+        failed = {}
+        for (pkg, what, proc) in procs:
+            out = proc.communicate()[0]
+            if proc.returncode != 0:
+                if what == "status":
+                    failed[pkg] = 1
+                # Note: diff fails when there is no upstream branch,
+                #       then there are no commits to look at.
+                continue
+            if not self.git_modified.has_key(pkg):
+                self.git_modified[pkg] = {}
+            modified = self.git_modified[pkg]
+            entries = out.split("\0")
+            i = 0
+            while i < len(entries):
+                entry = entries[i]
+                i += 1
+                if not entry:
+                    continue
+                if what == "diff":
+                    modified[entry] = 1
+                    continue
+                # Status entries are "XY path", renames and copies are
+                # followed by an entry with the original path.
+                modified[entry[3:]] = 1
+                if entry[0] in "RC":
+                    modified[entries[i]] = 1
+                    i += 1
+        for pkg in failed.keys():
+            print >>sys.stderr, "WARNING: git status failed for package", \
+                pkg + ", using stat instead."
+            if self.git_modified.has_key(pkg):
+                del self.git_modified[pkg]
+
     def check_if_file_modified(self, pkg, filenm):
-        """Check if a file in pkg has been modified by comparing
-           its modification date to the modification date of the
-           package directory."""
+        """Check if a file in pkg has been modified.  With git
+           detection this is a lookup in the files git reported,
+           otherwise compare the modification date of the file to
+           the modification date of the package directory."""
+        globals.stats.count("files_checked")
+        if self.git_modified.has_key(pkg):
+            if self.git_modified[pkg].has_key(filenm):
+                globals.stats.count("modified_files")
+                return True
+            return False
         dir = os.path.join(globals.mrb_source, pkg)
         fullnm = os.path.join(dir, filenm)
+        globals.stats.count("stat_calls", 2)
         if (os.stat(fullnm).st_mtime - os.stat(dir).st_mtime) > \
                 globals.stat_fudge:
             # File has been modified.
+            globals.stats.count("modified_files")
             return True
         # Nope, the file is unchanged.
         return False
 
     def handle_auto_checkout(self, pkg, other_end, dep_file):
-        """Perform an autocheckout of pkg, if enabled, because
+        """Queue an autocheckout of pkg, if enabled, because
            it makes use of dep_file ing package other_end which
            has been modified."""
         # Record that we have done this pkg, so that
@@ -233,21 +490,66 @@ class SYSTEM:
         print >>sys.stderr, "INFO: Checking out package", pkg,
         print >>sys.stderr, "due to modified file %s/%s" % \
                 (other_end, dep_file)
-        curdir = os.getcwd()
-        os.chdir(globals.mrb_source)
-        proc = subprocess.Popen(["mrb",  "gitCheckout",  pkg], \
-            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, \
-            universal_newlines=True)
-        msgs = proc.communicate()[0]
-        print >>sys.stderr, msgs,
-        if proc.returncode != 0:
-            if proc.returncode < 0:
-                print >>sys.stderr, \
-                    "ERROR: Checkout terminated by signal %d!" % \
-                    (-proc.returncode,)
-            else:
-                print >>sys.stderr, "ERROR: Checkout failed!"
-        os.chdir(curdir)
+        self.checkouts.append(pkg)
+
+    def run_checkouts(self):
+        """Checkout the collected pkgs, running up to -j checkouts at
+           the same time, and summarize the failures."""
+        if not self.checkouts:
+            return
+        todo = Queue.Queue()
+        for pkg in self.checkouts:
+            todo.put(pkg)
+        failed = []
+        workers = []
+        for i in range(min(globals.opts.jobs, len(self.checkouts))):
+            worker = threading.Thread(target=self.checkout_worker, \
+                args=(todo, failed))
+            worker.start()
+            workers.append(worker)
+        for worker in workers:
+            worker.join()
+        if failed:
+            failed.sort()
+            print >>sys.stderr, "ERROR: Checkout failed for packages:\n" + \
+                "         " + " ".join(failed)
+            sys.exit(1)
+
+    def checkout_worker(self, todo, failed):
+        """Checkout pkgs from todo until it is empty.  The output of a
+           checkout is printed in one piece when it is done."""
+        while True:
+            try:
+                pkg = todo.get_nowait()
+            except Queue.Empty:
+                return
+            # Note: gitCheckout is run directly rather than through
+            #       mrb, which would wait for the src lock we hold
+            #       already, so that checkouts can run at the same
+            #       time.  close_fds keeps concurrent checkouts from
+            #       holding each other's output pipes open.
+            proc = subprocess.Popen([globals.git_checkout, pkg], \
+                cwd=globals.mrb_source, close_fds=True, \
+                stdout=subprocess.PIPE, stderr=subprocess.STDOUT, \
+                universal_newlines=True)
+            msgs = proc.communicate()[0]
+            self.output_lock.acquire()
+            try:
+                if globals.opts.jobs > 1:
+                    print >>sys.stderr, "INFO: Output of checkout of " + \
+                        "package", pkg + ":"
+                print >>sys.stderr, msgs,
+                if proc.returncode != 0:
+                    if proc.returncode < 0:
+                        print >>sys.stderr, \
+                            "ERROR: Checkout terminated by signal %d!" % \
+                            (-proc.returncode,)
+                    else:
+                        print >>sys.stderr, "ERROR: Checkout failed!"
+                    failed.append(pkg)
+                    globals.stats.count("checkouts_failed")
+            finally:
+                self.output_lock.release()
 
 if __name__ == "__main__":
     # We are being run as a script.
@@ -0,0 +1,382 @@
+#!/usr/bin/env python
+# vim: ts=4 expandtab sw=4
+
+"""Construct a dependency database by scanning #include directives."""
+
+
+# Writes the same database as makeDep.py, but from the sources instead
+# of from the dependency files of a build, so that the base dependency
+# database of a release can be made without building it.
+#
+# The include roots searched, in this order, are:
+#
+#   $MRB_SOURCE/<pkg>                        (unless --no-source)
+#   <product dir>/<pkg>/<version>/include    (unless --no-products)
+#
+# for every product dir in $PRODUCTS.  A pkg of the first kind hides
+# a product of the same name.  Every C/C++ file below the roots is
+# scanned for #include directives, which are resolved like the
+# compiler does, first relative to the including file for the quoted
+# form and then against the roots.  The headers a pkg uses are all the
+# headers reachable from its files, as in the dependency files of a
+# build.  Conditional compilation is not evaluated, so the database
+# can have some edges a build would not.
+#
+# The includes of each file are cached by the hash of its contents,
+# with the stat information of each path to avoid reading unchanged
+# files at all.
+
+import depDatabase
+import optparse
+import os
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+import re
+import sys
+
+# Force the python version to be at least 2.4.x, which is
+# the version available in SLF5.x distributions (actually
+# they all ship with 2.4.3, and just for reference, all
+# of the SLF6.x distributions ship with 2.6.6).
+if (sys.version_info[0] < 2) or ((sys.version_info[0] == 2) and \
+        (sys.version_info[1] < 4)):
+    print >>sys.stderr, "ERROR: Python version must be at least 2.4!"
+    sys.exit(1)
+
+# hashlib needs at least python 2.5.
+try:
+    from hashlib import sha1
+except ImportError:
+    from sha import new as sha1
+
+# The process pool needs at least python 2.6, without it
+# we always scan serially.
+try:
+    import multiprocessing
+except ImportError:
+    multiprocessing = None
+
+# Files which are scanned for #include directives.
+pat_source_file = re.compile(
+    r".*[.](?:h|hh|hpp|hxx|i|icc|tcc|ipp|inl|c|cc|cpp|cxx|C)$")
+
+# Headers which are recorded in the database, as in makeDep.py.
+pat_header_file = re.compile(r".*[.](?:h|hh|hpp|i|icc|tcc)$")
+
+pat_include = re.compile(r'^[ \t]*#[ \t]*include[ \t]*([<"])([^>"\n]+)[>"]',
+    re.M)
+
+def list_pkg_files(root):
+    """Return the files below root, skipping hidden files and dirs."""
+    files = []
+    for (dirpath, dirnames, filenames) in os.walk(root):
+        dirnames[:] = [x for x in dirnames if not x.startswith(".")]
+        dirnames.sort()
+        for nm in sorted(filenames):
+            if not nm.startswith("."):
+                files.append(os.path.join(dirpath, nm))
+    return files
+
+def scan_file(filename, stamp_cache, include_cache):
+    """Return (stamp, hash, includes) for a file, where includes is a
+       list of (quote, name) pairs, using the cached results if the
+       file or its contents are unchanged."""
+    st = os.stat(filename)
+    stamp = (st.st_mtime, st.st_size)
+    entry = stamp_cache.get(filename)
+    if entry and (entry[0] == stamp) and include_cache.has_key(entry[1]):
+        return (stamp, entry[1], include_cache[entry[1]])
+    inf = open(filename, "rb")
+    data = inf.read()
+    inf.close()
+    digest = sha1(data).hexdigest()
+    includes = include_cache.get(digest)
+    if includes is None:
+        includes = pat_include.findall(data)
+    return (stamp, digest, includes)
+
+def scan_files(files, stamp_cache, include_cache):
+    """Scan files, returning { filename : (stamp, hash, includes) }."""
+    results = {}
+    for filename in files:
+        try:
+            results[filename] = scan_file(filename, stamp_cache,
+                include_cache)
+        except (IOError, OSError), e:
+            print >>sys.stderr, "WARNING: Unable to read %s: %s" % \
+                (filename, e)
+    return results
+
+# Caches used by the process pool workers.
+worker_caches = None
+
+def init_scan_worker(stamp_cache, include_cache):
+    """Process pool initializer, remember the caches."""
+    global worker_caches
+    worker_caches = (stamp_cache, include_cache)
+
+def scan_worker(files):
+    """Process pool entry point, scan the files of one pkg."""
+    return scan_files(files, worker_caches[0], worker_caches[1])
+
+class GLOBALS:
+    """Global variables container."""
+
+    def __init__(self):
+        """Constructor."""
+        # Results of parsing the command line.
+        self.opts = None
+        self.args = None
+        self.mrb_source = os.environ.get("MRB_SOURCE", "")
+        self.products = os.environ.get("PRODUCTS", "")
+        self.product_dirs = [x.rstrip(os.sep) for x in
+            self.products.split(":") if x]
+        # Bump this when the layout of the cache changes.
+        self.cache_version = 1
+
+    def parse_options(self):
+        """Parse the command line."""
+        descrip="Construct a dependency database without a build by " + \
+                "scanning the #include directives of the packages in " + \
+                "MRB_SOURCE and of the products in PRODUCTS."
+        usage="%prog [options] <output>"
+        p = optparse.OptionParser(usage=usage, description=descrip)
+        p.set_defaults(format="text", jobs=1, cache_file=None,
+            source=True, products=True)
+        p.add_option("-f", "--format", dest="format", type="choice",
+            choices=["text", "compact"],
+            help="format of the database, text or compact [%default]")
+        p.add_option("-j", dest="jobs", type="int", metavar="N",
+            help="scan N packages in parallel [%default]")
+        p.add_option("--cache", dest="cache_file", metavar="FILE",
+            help="scan cache to use [<output>.cache]")
+        p.add_option("--no-source", dest="source", action="store_false",
+            help="do not scan the packages in MRB_SOURCE")
+        p.add_option("--no-products", dest="products", action="store_false",
+            help="do not scan the products in PRODUCTS")
+        (self.opts, self.args) = p.parse_args()
+        if len(self.args) != 1:
+            p.error("wrong number of arguments")
+        if self.opts.jobs < 1:
+            p.error("-j must be at least 1")
+        if not self.opts.cache_file:
+            self.opts.cache_file = self.args[0] + ".cache"
+
+# Create an object to contain global variables.
+globals = GLOBALS()
+
+class SYSTEM:
+    """Master Controller."""
+
+    def __init__(self):
+        """Constructor."""
+        # Include roots in search order, [(pkg, root)].
+        self.roots = []
+        # Files of each pkg to scan, { pkg : [filename, ...] }.
+        self.pkg_files = {}
+        # Header of each file below a root, { filename : (pkg, path) },
+        # and the file found first for each path, { path : filename }.
+        self.file_headers = {}
+        self.path_files = {}
+        # Scan results, { filename : (stamp, hash, includes) }.
+        self.scanned = {}
+        # Cache from the previous run.
+        self.stamp_cache = {}
+        self.include_cache = {}
+        # Memoized resolved includes, { filename : [filename, ...] }.
+        self.resolved = {}
+
+    def run(self):
+        """Entry Point."""
+        globals.parse_options()
+        self.find_include_roots()
+        self.index_headers()
+        self.load_cache()
+        self.scan_packages()
+        db = self.make_database()
+        if globals.opts.format == "compact":
+            db.write_compact(globals.args[0])
+        else:
+            db.write_text(globals.args[0])
+        self.write_cache()
+
+    def find_include_roots(self):
+        """Find the include roots of the local pkgs and products."""
+        pkgs = {}
+        if globals.opts.source and globals.mrb_source:
+            for nm in sorted(os.listdir(globals.mrb_source)):
+                root = os.path.join(globals.mrb_source, nm)
+                if nm.startswith(".") or (not os.path.isdir(root)):
+                    continue
+                pkgs[nm] = 1
+                self.roots.append((nm, root))
+        if not globals.opts.products:
+            return
+        for prod_dir in globals.product_dirs:
+            if not os.path.isdir(prod_dir):
+                continue
+            for nm in sorted(os.listdir(prod_dir)):
+                if pkgs.has_key(nm):
+                    # Hidden by a local pkg or an earlier product dir.
+                    continue
+                root = self.product_include_root(prod_dir, nm)
+                if root is None:
+                    continue
+                pkgs[nm] = 1
+                self.roots.append((nm, root))
+
+    def product_include_root(self, prod_dir, pkg):
+        """Return the include dir of product pkg, or None.  If there
+           are several versions, the one set up (from the
+           <PKG>_VERSION variable) or else the last one is used."""
+        pkg_dir = os.path.join(prod_dir, pkg)
+        if not os.path.isdir(pkg_dir):
+            return None
+        versions = []
+        for nm in sorted(os.listdir(pkg_dir)):
+            if nm.startswith("v") and \
+                    os.path.isdir(os.path.join(pkg_dir, nm, "include")):
+                versions.append(nm)
+        if not versions:
+            return None
+        version = os.environ.get(pkg.upper() + "_VERSION")
+        if version not in versions:
+            if len(versions) > 1:
+                print >>sys.stderr, "WARNING: Using %s of %s in %s, " \
+                    "other versions: %s" % (versions[-1], pkg, prod_dir,
+                    " ".join(versions[:-1]))
+            version = versions[-1]
+        return os.path.join(pkg_dir, version, "include")
+
+    def index_headers(self):
+        """List the files below the include roots."""
+        for (pkg, root) in self.roots:
+            files = []
+            for filename in list_pkg_files(root):
+                path = filename[len(root) + 1:]
+                self.file_headers[filename] = (pkg, path)
+                if not self.path_files.has_key(path):
+                    self.path_files[path] = filename
+                if pat_source_file.match(filename):
+                    files.append(filename)
+            self.pkg_files[pkg] = files
+
+    def load_cache(self):
+        """Load the scan cache written by the previous run."""
+        if not os.path.exists(globals.opts.cache_file):
+            return
+        try:
+            inf = open(globals.opts.cache_file, "rb")
+            try:
+                cache = pickle.load(inf)
+            finally:
+                inf.close()
+        except Exception:
+            print >>sys.stderr, "WARNING: ignoring unreadable cache", \
+                globals.opts.cache_file
+            return
+        if (not isinstance(cache, dict)) or \
+                (cache.get("version") != globals.cache_version):
+            return
+        self.stamp_cache = cache["stamps"]
+        self.include_cache = cache["includes"]
+
+    def write_cache(self):
+        """Write the scan cache for the next run, with only the files
+           seen by this run."""
+        stamps = {}
+        includes = {}
+        for (filename, (stamp, digest, file_includes)) in \
+                self.scanned.items():
+            stamps[filename] = (stamp, digest)
+            includes[digest] = file_includes
+        cache = {
+            "version" : globals.cache_version,
+            "stamps" : stamps,
+            "includes" : includes }
+        tmp_name = "%s.%d" % (globals.opts.cache_file, os.getpid())
+        outf = open(tmp_name, "wb")
+        pickle.dump(cache, outf, pickle.HIGHEST_PROTOCOL)
+        outf.close()
+        os.rename(tmp_name, globals.opts.cache_file)
+
+    def scan_packages(self):
+        """Scan the files of all pkgs for #include directives."""
+        pkgs = [x[0] for x in self.roots]
+        jobs = min(globals.opts.jobs, len(pkgs))
+        if (jobs > 1) and (multiprocessing is None):
+            print >>sys.stderr, "WARNING: multiprocessing is not " + \
+                "available, scanning serially."
+            jobs = 1
+        work = [self.pkg_files[x] for x in pkgs]
+        if jobs > 1:
+            pool = multiprocessing.Pool(jobs, init_scan_worker,
+                (self.stamp_cache, self.include_cache))
+            try:
+                results = pool.map(scan_worker, work, 1)
+            except:
+                pool.terminate()
+                pool.join()
+                raise
+            pool.close()
+            pool.join()
+        else:
+            results = [scan_files(x, self.stamp_cache, self.include_cache)
+                for x in work]
+        for result in results:
+            self.scanned.update(result)
+
+    def resolve_includes(self, filename):
+        """Return the files below the include roots which filename
+           includes."""
+        if self.resolved.has_key(filename):
+            return self.resolved[filename]
+        found = []
+        entry = self.scanned.get(filename)
+        if entry is not None:
+            dirname = os.path.dirname(filename)
+            for (quote, name) in entry[2]:
+                name = name.strip()
+                target = None
+                if quote == '"':
+                    # Relative to the including file first.
+                    target = os.path.normpath(os.path.join(dirname, name))
+                    if not self.file_headers.has_key(target):
+                        target = None
+                if target is None:
+                    target = self.path_files.get(os.path.normpath(name))
+                if target is not None:
+                    found.append(target)
+        self.resolved[filename] = found
+        return found
+
+    def make_database(self):
+        """Return the database of the headers each pkg uses, directly
+           or through other headers."""
+        db = depDatabase.DEPENDENCY_DATABASE()
+        for (pkg, root) in self.roots:
+            seen = {}
+            todo = []
+            for filename in self.pkg_files[pkg]:
+                todo.extend(self.resolve_includes(filename))
+            while todo:
+                filename = todo.pop()
+                if seen.has_key(filename):
+                    continue
+                seen[filename] = 1
+                todo.extend(self.resolve_includes(filename))
+            for filename in seen.keys():
+                (dep, dep_file) = self.file_headers[filename]
+                if pat_header_file.match(dep_file):
+                    db.add_edge(pkg, dep, dep_file)
+        return db
+
+if __name__ == "__main__":
+    # We are being run as a script.
+    system = SYSTEM()
+    system.run()
+else:
+    # We are being loaded as a module.
+    pass
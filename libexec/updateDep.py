@@ -0,0 +1,358 @@
+#!/usr/bin/env python
+# vim: ts=4 expandtab sw=4
+
+"""Update product versions in the packages of a development area."""
+
+
+# The engine of mrb updateDepsPV.  Each ups/product_deps file in
+# MRB_SOURCE is read once and all of the requested
+#
+#   <product> <version>
+#
+# updates are applied to it together, in the same way as
+# edit_product_deps does for a single product.  The CMakeLists.txt
+# files which need a new version, that of the package which is one
+# of the products and releaseDB/ or bundle/ files which mention one,
+# are found in the same pass and handed to edit_cmake, which knows
+# how to rewrite cmake code.  Packages are processed in parallel with
+# -j N, and files are replaced atomically, keeping a .bak copy.
+
+import difflib
+import optparse
+import os
+import Queue
+import re
+import shutil
+import subprocess
+import sys
+import threading
+
+# Force the python version to be at least 2.4.x, which is
+# the version available in SLF5.x distributions (actually
+# they all ship with 2.4.3, and just for reference, all
+# of the SLF6.x distributions ship with 2.6.6).
+if (sys.version_info[0] < 2) or ((sys.version_info[0] == 2) and \
+        (sys.version_info[1] < 4)):
+    print >>sys.stderr, "ERROR: Python version must be at least 2.4!"
+    sys.exit(1)
+
+parent_pat = re.compile(r"^(\s*parent\s+)([^#\s]+)(\s+)([^#\s]+)")
+parent_only_pat = re.compile(r"^\s*parent\s+([^#\s]+)")
+product_table_pat = re.compile(r"^(\s*)(\S+)(\s+)[^-\s]\S+")
+product_start_pat = re.compile(r"^\s*product\b")
+product_end_pat = re.compile(r"^\s*end_product_list\b")
+ups_version_pat = re.compile(r"^v[0-9]\S*$")
+
+def unquote(version):
+    """Return version without the quotes around it, if any."""
+    if (len(version) > 1) and (version[0] in "\"'") and \
+            (version[-1] == version[0]):
+        return version[1:-1]
+    return version
+
+def to_ups_version(version, libexec):
+    """Return the ups form of a version as edit_product_deps makes it,
+       versions not starting with v[0-9] converted by Cetmodules from
+       libexec.  Raise ValueError if there is none."""
+    if re.match(r"^v[0-9]", version):
+        return version
+    try:
+        proc = subprocess.Popen(["perl", "-I" + libexec, "-mCetmodules",
+            "-MCetmodules::Util=to_ups_version",
+            "-e", "print to_ups_version($ARGV[0]), qq(\\n);",
+            "--", version],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            universal_newlines=True)
+    except OSError, e:
+        raise ValueError("cannot run perl: %s" % e.strerror)
+    (out, err) = proc.communicate()
+    ups_version = out.strip()
+    if proc.returncode != 0:
+        raise ValueError((err.strip() or "Cetmodules failed").split("\n")[0])
+    if not ups_version_pat.match(ups_version):
+        raise ValueError("Cetmodules made it %r" % ups_version)
+    return ups_version
+
+def edit_product_deps(lines, versions):
+    """Return the lines of a product_deps file with the versions of
+       the products in versions, { product : ups version }, replaced,
+       and a list of (product, parent) for each replacement, parent
+       being whether it was the version of the package itself."""
+    result = []
+    edits = []
+    in_product_list = False
+    for line in lines:
+        parent = True
+        match = parent_pat.match(line)
+        if (not match) and in_product_list:
+            parent = False
+            match = product_table_pat.match(line)
+        if match and versions.has_key(match.group(2)):
+            product = match.group(2)
+            line = match.group(1) + product + match.group(3) + \
+                versions[product] + line[match.end():]
+            edits.append((product, parent))
+        elif product_start_pat.match(line):
+            in_product_list = True
+        elif product_end_pat.match(line):
+            in_product_list = False
+        result.append(line)
+    return (result, edits)
+
+def replace_file(filename, lines):
+    """Replace filename atomically with lines, keeping the old contents
+       in filename.bak."""
+    tmp_filename = "%s.%d" % (filename, os.getpid())
+    outf = open(tmp_filename, "w")
+    try:
+        outf.writelines(lines)
+    finally:
+        outf.close()
+    shutil.copymode(filename, tmp_filename)
+    shutil.copy2(filename, filename + ".bak")
+    os.rename(tmp_filename, filename)
+
+class GLOBALS:
+    """Global variables container."""
+
+    def __init__(self):
+        """Constructor."""
+        # Results of parsing the command line.
+        self.opts = None
+        self.args = None
+        self.mrb_source = os.environ.get("MRB_SOURCE", "")
+        self.mrb_command = os.environ.get("mrb_command", "mrb")
+        self.libexec = os.path.dirname(os.path.abspath(__file__))
+        self.edit_cmake = os.path.join(self.libexec, "edit_cmake")
+        # The requested updates in order, (product, version as given),
+        # and { product : ups version }.
+        self.updates = []
+        self.versions = {}
+
+    def parse_options(self):
+        """Parse the command line."""
+        descrip="Change the versions of the given products in " + \
+                "ups/product_deps, and in the CMakeLists.txt files " + \
+                "which set them, of every package checked out in " + \
+                "MRB_SOURCE."
+        usage="%prog [options] <product> <version> [<product> <version> ...]"
+        p = optparse.OptionParser(usage=usage, description=descrip)
+        p.set_defaults(dry_run=False, jobs=1, update_file=None)
+        p.add_option("-d", dest="dry_run", action="store_true",
+            help="do a dry run, print the changes without changing " + \
+            "any files")
+        p.add_option("-f", dest="update_file", metavar="FILE",
+            help="also read <product> <version> pairs from FILE, " + \
+            "one pair per line, # starts a comment")
+        p.add_option("-j", dest="jobs", type="int", metavar="N",
+            help="update up to N packages at the same time [%default]")
+        (self.opts, self.args) = p.parse_args()
+        if self.opts.jobs < 1:
+            p.error("-j must be at least 1")
+        words = []
+        if self.opts.update_file:
+            try:
+                inf = open(self.opts.update_file, "r")
+            except IOError, e:
+                p.error("cannot read %s: %s" % (self.opts.update_file,
+                    e.strerror))
+            for line in inf:
+                words.extend(line.split("#", 1)[0].split())
+            inf.close()
+        words.extend(self.args)
+        if not words:
+            p.error("no product given")
+        if len(words) % 2:
+            p.error("no version given for %s" % words[-1])
+        # { version : ups version }, each version is converted once.
+        ups_versions = {}
+        for i in range(0, len(words), 2):
+            (product, version) = (words[i], words[i + 1])
+            if not ups_versions.has_key(version):
+                try:
+                    ups_versions[version] = \
+                        to_ups_version(unquote(version), self.libexec)
+                except ValueError, e:
+                    p.error("cannot make a ups version of %s for %s: %s" \
+                        % (version, product, e))
+            ups_version = ups_versions[version]
+            if self.versions.has_key(product):
+                p.error("more than one version given for %s" % product)
+            self.updates.append((product, version))
+            self.versions[product] = ups_version
+        if not self.mrb_source:
+            p.error("MRB_SOURCE is not defined")
+
+# Create an object to contain global variables.
+globals = GLOBALS()
+
+class SYSTEM:
+    """Master Controller."""
+
+    def __init__(self):
+        """Constructor."""
+        # Matches any of the products as a word.
+        self.products_pat = None
+        self.output_lock = threading.Lock()
+        self.updated_files = 0
+        self.failed = []
+
+    def run(self):
+        """Entry Point."""
+        globals.parse_options()
+        if globals.opts.dry_run:
+            print "DRY RUN: changes are not saved"
+        self.products_pat = re.compile(r"\b(%s)\b" % "|".join(
+            [re.escape(x[0]) for x in globals.updates]))
+        pkg_dirs = self.get_list_of_pkg_dirs()
+        todo = Queue.Queue()
+        for pkg_dir in pkg_dirs:
+            todo.put(pkg_dir)
+        workers = []
+        for i in range(min(globals.opts.jobs, len(pkg_dirs))):
+            worker = threading.Thread(target=self.update_worker,
+                args=(todo,))
+            worker.start()
+            workers.append(worker)
+        for worker in workers:
+            worker.join()
+        print
+        status = 0
+        if self.failed:
+            self.failed.sort()
+            print >>sys.stderr, "ERROR: update failed for packages:\n" + \
+                "         " + " ".join(self.failed)
+            status = 1
+        if globals.opts.dry_run:
+            print "INFO: if the dry run was successful, run: "
+            print " %s uv %s" % (globals.mrb_command,
+                " ".join(["%s %s" % x for x in globals.updates]))
+        else:
+            action = ""
+            if self.updated_files:
+                action = ": be sure to re-run mrbsetenv"
+            print "INFO: updated %d file%s%s" % (self.updated_files,
+                ((self.updated_files == 1) and "") or "s", action)
+        sys.exit(status)
+
+    def get_list_of_pkg_dirs(self):
+        """Return the directories in MRB_SOURCE with a product_deps."""
+        result = []
+        for name in sorted(os.listdir(globals.mrb_source)):
+            pkg_dir = os.path.join(globals.mrb_source, name)
+            if os.access(os.path.join(pkg_dir, "ups", "product_deps"),
+                    os.R_OK):
+                result.append(pkg_dir)
+        return result
+
+    def update_worker(self, todo):
+        """Update pkgs from todo until it is empty.  The output of
+           each pkg is printed in one piece when it is done."""
+        while True:
+            try:
+                pkg_dir = todo.get_nowait()
+            except Queue.Empty:
+                return
+            msgs = []
+            try:
+                (ok, updated_files) = self.update_pkg(pkg_dir, msgs)
+            except (IOError, OSError), e:
+                msgs.append("ERROR: %s\n" % e)
+                (ok, updated_files) = (False, 0)
+            self.output_lock.acquire()
+            try:
+                sys.stdout.write("".join(msgs))
+                sys.stdout.flush()
+                self.updated_files += updated_files
+                if not ok:
+                    self.failed.append(os.path.basename(pkg_dir))
+            finally:
+                self.output_lock.release()
+
+    def update_pkg(self, pkg_dir, msgs):
+        """Update the files of the package in pkg_dir, adding the
+           messages to msgs.  Return whether it succeeded and the
+           number of files updated."""
+        pdfile = os.path.join(pkg_dir, "ups", "product_deps")
+        cmfile = os.path.join(pkg_dir, "CMakeLists.txt")
+        if not os.access(cmfile, os.R_OK):
+            msgs.append("WARNING: cannot find CMakeLists.txt in %s\n" % \
+                pkg_dir)
+            return (False, 0)
+        updated_files = 0
+        inf = open(pdfile, "r")
+        lines = inf.readlines()
+        inf.close()
+        pkg_name = None
+        for line in lines:
+            match = parent_only_pat.match(line)
+            if match:
+                pkg_name = match.group(1)
+                break
+        (new_lines, edits) = edit_product_deps(lines, globals.versions)
+        if globals.versions.has_key(pkg_name) and \
+                not (pkg_name, True) in edits:
+            msgs.append("INFO: version information for %s is set by " \
+                "project() in %s\n" % (pkg_name, cmfile))
+        for (product, parent) in edits:
+            if parent:
+                msgs.append("INFO: updating %s version in %s\n" % \
+                    (product, pdfile))
+            else:
+                msgs.append("INFO: updating %s version for dependent " \
+                    "%s in %s\n" % (product, pkg_name, pdfile))
+        if edits:
+            updated_files += 1
+            if globals.opts.dry_run:
+                msgs.extend(difflib.unified_diff(lines, new_lines,
+                    pdfile, pdfile + " (new)"))
+            else:
+                replace_file(pdfile, new_lines)
+        # The (file, product) pairs for edit_cmake.
+        cmake_edits = []
+        if globals.versions.has_key(pkg_name):
+            cmake_edits.append((cmfile, pkg_name))
+        for subdir in ["releaseDB", "bundle"]:
+            sub_cmfile = os.path.join(pkg_dir, subdir, "CMakeLists.txt")
+            if not os.access(sub_cmfile, os.R_OK):
+                continue
+            inf = open(sub_cmfile, "r")
+            mentioned = {}
+            for match in self.products_pat.finditer(inf.read()):
+                mentioned[match.group(1)] = 1
+            inf.close()
+            for (product, version) in globals.updates:
+                if mentioned.has_key(product):
+                    cmake_edits.append((sub_cmfile, product))
+        for (filename, product) in cmake_edits:
+            msgs.append("INFO: updating %s version in %s\n" % \
+                (product, filename))
+            if not self.edit_cmake(filename, product, msgs):
+                return (False, updated_files)
+            updated_files += 1
+        return (True, updated_files)
+
+    def edit_cmake(self, filename, product, msgs):
+        """Run edit_cmake for one product of a cmake file, adding its
+           output to msgs.  Return whether it succeeded."""
+        version = [x[1] for x in globals.updates if x[0] == product][0]
+        dry_run = (globals.opts.dry_run and "yes") or "no"
+        # Note: close_fds keeps concurrent edits from holding each
+        #       other's output pipes open.
+        proc = subprocess.Popen([globals.edit_cmake, filename, product,
+            version, dry_run], close_fds=True, stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT, universal_newlines=True)
+        msgs.append(proc.communicate()[0])
+        if proc.returncode != 0:
+            msgs.append("ERROR: edit_cmake failed for %s in %s\n" % \
+                (product, filename))
+            return False
+        return True
+
+if __name__ == "__main__":
+    # We are being run as a script.
+    system = SYSTEM()
+    system.run()
+else:
+    # We are being loaded as a module.
+    pass
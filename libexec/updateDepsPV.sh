@@ -13,40 +13,21 @@ fullCom="$mrb_command $thisCom"
 function usage() 
 {
   cat 1>&2 << EOF
-Usage: $fullCom <product> <version>
+Usage: $fullCom [-d] [-j N] [-f FILE] <product> <version> [<product> <version> ...]
   Update ups/product_deps.
   Change the version of <product> to <version> 
   This command updates every package you have checked out in $MRB_SOURCE.
+  All of the given products are updated together.
 
   Options:
           -d = do a dry run -- print out what would change without actually changing any files
+          -j N = update up to N packages at the same time
+          -f FILE = also read <product> <version> pairs from FILE, one per line
           -R = Restore the old product_deps files from git
 
 EOF
 }
 
-function modify_product_deps()
-{
-  have_dep="$(sed -Ene '/^product[[:space:]]+version\b/,/^end_product_list/ { /^'"$product"'\b/ { p ; q; }; }' "$pdfile" || :)"
-  if [ -n "$have_dep" ]; then
-    echo "INFO: updating $product version for dependent $pkg_name in $pdfile"
-  elif [ "$pkg_name" = "$product" ]; then
-    echo "INFO: updating $product version in $pdfile"
-  else
-    return 0
-  fi
-  (( ++updated_files ))
-  "$MRB_DIR/libexec/edit_product_deps" "$pdfile" $product $new_version $dryRun
-}
-
-function modify_cmake()
-{
-  local cfile=$1
-  echo "INFO: updating $product version in $cfile"
-  (( ++updated_files ))
-  "$MRB_DIR/libexec/edit_cmake" "$cfile" $product $new_version $dryRun
-}
-
 function get_package_list()
 {
   local dir OIFS IFS
@@ -62,15 +43,17 @@ function get_package_list()
   done
 }
 
-dryRun="no"
 restore="no"
+engine_args=()
 
 # Determine command options (just -h for help)
-while getopts ":hdRp:" OPTION
+while getopts ":hdRj:f:" OPTION
 do
     case $OPTION in
         h   ) usage ; exit 0 ;;
-        d   ) dryRun="yes" ; echo 'DRY RUN: changes are not saved';;
+        d   ) engine_args+=(-d) ;;
+        j   ) engine_args+=(-j "$OPTARG") ;;
+        f   ) engine_args+=(-f "$OPTARG") ;;
         R   ) restore="yes" ;; 
         *   ) echo "ERROR: Unknown option" ; usage ; exit 1 ;;
     esac
@@ -104,52 +87,9 @@ if [ $restore == "yes" ]; then
     fi
   done
 else
-  operation="update"
-
-  # Did the user provide a product name?
+  # Updates are done in one pass over all packages by updateDep.py.
   shift $((OPTIND - 1))
-  if [ $# -lt 1 ]; then
-    echo "ERROR: no product given" 1>&2
-    usage 1>&2
-    exit 1
-  fi
-
-  # Capture the product name
-  product=$1
-
-  # check for version
-  if [ $# -lt 2 ]; then
-    echo "ERROR: no version given" 1>&2
-    usage 1>&2
-    exit 1
-  fi
-  new_version=$2
-
-  get_package_list
-
-  for pkg_dir in "${pkg_dirs[@]}"; do
-    pdfile="$pkg_dir/ups/product_deps"
-    pkg_name="$(sed -Ene 's&^[[:space:]]*parent[[:space:]]+([^[:space:]\#]+).*&\1&p; T; q' "${pdfile}")"
-    # Sanity checks
-    if [ ! -r "$pkg_dir"/CMakeLists.txt ]; then
-      echo "WARNING: cannot find CMakeLists.txt in $pkg_dir" 1>&2
-      false
-    elif [ ! -r "$pdfile" ]; then
-      echo "WARNING: cannot find ups/product_deps in $pkg_dir" 1>&2
-      false
-    else
-      modify_product_deps "$pfdile" && \
-        { if [ "$pkg_name" = "$product" ]; then \
-        modify_cmake "$pkg_dir/CMakeLists.txt"; fi; } && \
-        { cmf="$pkg_dir"/releaseDB/CMakeLists.txt; \
-        if [ -r "$cmf" ] && grep -Ee '\b'"$product"'\b' "$cmf" >/dev/null 2>&1; then \
-        modify_cmake "$cmf"; fi; } && \
-        { cmf="$pkg_dir"/bundle/CMakeLists.txt; \
-        if [ -r "$cmf" ] && grep -Ee '\b'"$product"'\b' "$cmf" >/dev/null 2>&1; then \
-        modify_cmake "$cmf"; fi; }
-    fi
-    (( $? == 0 )) || failed+=($pkg_name)
-  done
+  exec "$MRB_DIR/libexec/updateDep.py" "${engine_args[@]}" "$@"
 fi
 
 echo
@@ -160,13 +100,4 @@ else
   status=0
 fi
 
-if [ "$dryRun" = "yes" ]; then
-  echo "INFO: if the dry run was successful, run: "
-  echo " mrb uv $product $new_version"
-else
-  (( updated_files == 1 )) && plural='' || plural='s'
-  (( updated_files )) && action=': be sure to re-run mrbsetenv'
-  printf "INFO: updated %d file%s%s\n" "$updated_files" "$plural" "$action"
-fi
-
 exit $status
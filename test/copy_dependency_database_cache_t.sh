@@ -0,0 +1,40 @@
+#!/usr/bin/env bash
+
+# copy_dependency_database.sh must file the base database of a release
+# in the shared cache under the version it is given, as newDev.sh runs
+# it, where MRB_PROJECT_VERSION is not in the environment.
+
+. "$(dirname "$0")/mrb_test_area.sh" "$@"
+
+export MRB_DEP_CACHE="$T/cache"
+unset MRB_PROJECT_VERSION
+
+for version in v3_14_00 v3_15_00
+do
+  export ART_DIR="$T/products/art/${version}"
+  mkdir -p "${ART_DIR}/releaseDB" || exit
+  echo "art : cetlib : cetlib/${version}.h" > \
+    "${ART_DIR}/releaseDB/base_dependency_database"
+  "${MRB_DIR}/libexec/copy_dependency_database.sh" \
+    "${MRB_SOURCE}" "${MRB_INSTALL}" ART_DIR "${version}" || \
+    fail "copy_dependency_database.sh failed for ${version}"
+  hash=$(sha1sum < "${ART_DIR}/releaseDB/base_dependency_database" | \
+    cut -d' ' -f1)
+  cached="${MRB_DEP_CACHE}/art/${version}/${hash}.compact"
+  [ -e "${cached}" ] || fail "${version} is not cached as ${cached}:
+$(cd "${MRB_DEP_CACHE}" && find . -type f)"
+  [ "${MRB_INSTALL}/.base_dependency_database" -ef "${cached}" ] || \
+    fail "${MRB_INSTALL}/.base_dependency_database is not ${cached}"
+done
+[ -d "${MRB_DEP_CACHE}/art/unknown" ] && \
+  fail "a database was cached under art/unknown"
+
+# Every caller passes the project version.
+for script in newDev.sh mrbSetEnv
+do
+  grep 'copy_dependency_database\.sh ' "${MRB_DIR}/libexec/${script}" | \
+    grep -v 'MRB_PROJECT_VERSION}$' && \
+    fail "${script} runs copy_dependency_database.sh without the version"
+done
+
+exit 0
@@ -0,0 +1,41 @@
+# Common setup of the mrb tests, sourced with the arguments of the test:
+#
+#   <mrb source directory> <cetmodules libexec directory>
+#
+# Makes a scratch directory $T, removed on exit, with an mrb in $MRB_DIR
+# laid out as installed, and sets up the environment of a development
+# area in $T/area for MRB_PROJECT art.  Git reads its configuration from
+# $HOME/.gitconfig only.
+
+function fail()
+{
+  echo "FAIL: $*" 1>&2
+  exit 1
+}
+
+mrb_src_dir=$(cd "${1:-$(dirname "$0")/..}" && pwd -P) || exit
+cetmodules_libexec=${2:-${CETMODULES_DIR:+${CETMODULES_DIR}/libexec}}
+[ -n "${cetmodules_libexec}" ] && [ -d "${cetmodules_libexec}" ] || \
+  fail "cannot find the cetmodules libexec directory"
+
+T=$(mktemp -d "${TMPDIR:-/tmp}/mrb_test.XXXXXX") || exit
+trap 'rm -rf "$T"' EXIT
+
+export MRB_DIR="$T/mrb"
+mkdir -p "${MRB_DIR}/libexec" || exit
+cp -R "${cetmodules_libexec}/." "${MRB_DIR}/libexec/" || exit
+cp -R "${mrb_src_dir}/bin" "${mrb_src_dir}/templates" "${MRB_DIR}/" || exit
+cp -R "${mrb_src_dir}/libexec/." "${MRB_DIR}/libexec/" || exit
+export PATH="${MRB_DIR}/bin:${PATH}"
+
+export HOME="$T/home" XDG_CONFIG_HOME="$T/home/.config" GIT_CONFIG_NOSYSTEM=1
+mkdir -p "${HOME}" || exit
+git config --global user.name "mrb test"
+git config --global user.email "mrb_test@localhost"
+
+export UPS_DIR="$T/ups" MRB_PROJECT=art MRB_PROJECT_VERSION=v3_14_00
+export MRB_TOP="$T/area"
+export MRB_SOURCE="${MRB_TOP}/srcs" MRB_BUILDDIR="${MRB_TOP}/build"
+export MRB_INSTALL="${MRB_TOP}/localProducts"
+mkdir -p "${UPS_DIR}" "${MRB_SOURCE}" "${MRB_BUILDDIR}" "${MRB_INSTALL}" || exit
+unset MRB_DEP_CACHE XDG_CACHE_HOME
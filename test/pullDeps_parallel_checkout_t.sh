@@ -0,0 +1,70 @@
+#!/usr/bin/env bash
+
+# mrb pullDeps -j 3 must run its checkouts at the same time.  The
+# checkouts are real gitCheckout runs of art suite packages, with
+# github redirected to local repositories, and a post-checkout hook
+# which takes a while and records when each checkout ran.
+
+. "$(dirname "$0")/mrb_test_area.sh" "$@"
+
+pkgs="canvas cetlib messagefacility"
+
+remote="$T/remote"
+for pkg in ${pkgs}
+do
+  work="$T/work/${pkg}"
+  mkdir -p "${work}/ups" || exit
+  printf 'parent %s v1_00_00\n' "${pkg}" > "${work}/ups/product_deps"
+  printf 'project(%s)\n' "${pkg}" > "${work}/CMakeLists.txt"
+  git init -q -b develop "${work}" && \
+    git -C "${work}" add -A && \
+    git -C "${work}" commit -q -m "Initial version" && \
+    git clone -q --bare "${work}" \
+      "${remote}/art-framework-suite/${pkg}.git" || exit
+done
+git config --global url."${remote}/".insteadOf https://github.com/
+git config --global --add url."${remote}/".insteadOf git@github.com:
+
+mkdir -p "$T/hooks" || exit
+cat > "$T/hooks/post-checkout" <<EOF
+#!/usr/bin/env bash
+[ -e .git/mrb_test_seen ] && exit 0
+touch .git/mrb_test_seen
+echo "\$(basename "\$(pwd)") start \$(date +%s.%N)" >> "$T/checkouts.log"
+sleep 3
+echo "\$(basename "\$(pwd)") end \$(date +%s.%N)" >> "$T/checkouts.log"
+EOF
+chmod +x "$T/hooks/post-checkout"
+git config --global core.hooksPath "$T/hooks"
+
+# A checked out cetlib_except with a modified header, used by the
+# packages in the base dependency database.
+"${MRB_DIR}/libexec/copy_files_to_srcs.sh" -c "${MRB_SOURCE}" || exit
+mkdir -p "${MRB_SOURCE}/cetlib_except/cetlib_except" || exit
+touch "${MRB_SOURCE}/cetlib_except/cetlib_except/exception.h"
+touch -d "-1 hour" "${MRB_SOURCE}/cetlib_except"
+for pkg in ${pkgs}
+do
+  echo "${pkg} : cetlib_except : cetlib_except/exception.h"
+done > "${MRB_TOP}/.base_dependency_database"
+
+"${MRB_DIR}/bin/mrb" pullDeps -j 3 --no-server || \
+  fail "mrb pullDeps -j 3 failed"
+
+for pkg in ${pkgs}
+do
+  [ -d "${MRB_SOURCE}/${pkg}/.git" ] || fail "${pkg} was not checked out"
+  n=$(grep -c "^mrb_add_subdirectory(${pkg})" "${MRB_SOURCE}/.cmake_add_subdir")
+  [ "$n" = 1 ] || fail "${pkg} was added to CMakeLists.txt ${n} times"
+done
+[ $(wc -l < "$T/checkouts.log") = 6 ] || fail "unexpected checkout log:
+$(cat "$T/checkouts.log")"
+
+# Every checkout started before any of them ended.
+last_start=$(awk '$2 == "start" { print $3 }' "$T/checkouts.log" | sort -n | tail -1)
+first_end=$(awk '$2 == "end" { print $3 }' "$T/checkouts.log" | sort -n | head -1)
+awk -v s="${last_start}" -v e="${first_end}" 'BEGIN { exit !(s < e) }' || \
+  fail "checkouts did not run at the same time:
+$(cat "$T/checkouts.log")"
+
+exit 0
@@ -0,0 +1,67 @@
+#!/usr/bin/env bash
+
+# mrb updateDepsPV must write the ups version Cetmodules makes of a
+# version, as edit_product_deps does, including release candidates and
+# other versions with a suffix, and refuse a version Cetmodules cannot
+# convert instead of writing it as it is.
+
+. "$(dirname "$0")/mrb_test_area.sh" "$@"
+
+pdfile="${MRB_SOURCE}/mypkg/ups/product_deps"
+mkdir -p "${MRB_SOURCE}/mypkg/ups" || exit
+printf 'project(mypkg)\n' > "${MRB_SOURCE}/mypkg/CMakeLists.txt"
+cat > "${pdfile}.orig" <<EOF
+parent mypkg v1_00_00
+
+product version
+cetlib v3_01_00
+end_product_list
+EOF
+
+# What Cetmodules makes of a version, if anything.
+function cetmodules_ups_version()
+{
+  perl -I"${MRB_DIR}/libexec" -mCetmodules \
+    -MCetmodules::Util=to_ups_version \
+    -e 'print to_ups_version($ARGV[0]), qq(\n);' -- "$1" 2>/dev/null
+}
+
+for version in 1.2.3-rc1 1.2.3-rc.1 1.2.3rc1 1.2-3 1.2.3 2.0 v3_02_00rc1
+do
+  cp "${pdfile}.orig" "${pdfile}" || exit
+  if [[ "${version}" == v[0-9]* ]]
+  then
+    expected="${version}"
+  else
+    expected=$(cetmodules_ups_version "${version}")
+  fi
+  if "${MRB_DIR}/bin/mrb" updateDepsPV cetlib "${version}" > "$T/out" 2>&1
+  then
+    [[ "${expected}" == v[0-9]* ]] || \
+      fail "${version} was accepted, Cetmodules made it \"${expected}\""
+    grep -qx "cetlib ${expected}" "${pdfile}" || \
+      fail "${version} was not written as ${expected}:
+$(cat "${pdfile}")"
+  else
+    [[ "${expected}" == v[0-9]* ]] && \
+      fail "${version} (${expected}) was refused:
+$(cat "$T/out")"
+    grep -q "cannot make a ups version of ${version}" "$T/out" || \
+      fail "no error for ${version}:
+$(cat "$T/out")"
+    cmp -s "${pdfile}.orig" "${pdfile}" || fail "${version} changed ${pdfile}"
+  fi
+  # A suffixed version is never written as it was given.
+  grep -qx "cetlib ${version}" "${pdfile}" && [[ "${version}" != v* ]] && \
+    fail "${version} was written unchanged"
+done
+
+# The dotted part of a release candidate is converted.
+cp "${pdfile}.orig" "${pdfile}" || exit
+"${MRB_DIR}/bin/mrb" updateDepsPV cetlib 1.2.3-rc1 > /dev/null 2>&1 || \
+  fail "1.2.3-rc1 was refused"
+grep -q "^cetlib v1_02_03" "${pdfile}" || \
+  fail "1.2.3-rc1 was not written as v1_02_03...:
+$(cat "${pdfile}")"
+
+exit 0